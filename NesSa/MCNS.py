@@ -7,7 +7,6 @@ from ase import io
 from timeit import default_timer as timer
 import math
 #import cProfile
-from mpi4py import MPI
 
 #for reading/writing
 
@@ -27,6 +26,58 @@ move_types = ['box','translate', 'rotate', 'dihedral', 'shear', 'stretch']
 ivol = 0; itrans = 1; irot = 2; idih = 3; ishear = 4; istr = 5
 
 
+class WalkerState:
+    """State of one walker as numpy arrays, the form in which walkers are moved in and out of hs_alkane.
+    ASE atoms objects are only built from it where configurations are written out.
+        Attributes:
+            cell: (3,3) array of cell vectors.
+            coords: (nchains,nbeads,3) contiguous array of bead positions."""
+
+    def __init__(self, cell, coords):
+        self.cell = cell
+        self.coords = coords
+
+    @classmethod
+    def empty(cls, nbeads, nchains):
+        return cls(np.empty((3,3)), np.empty((nchains,nbeads,3)))
+
+    @classmethod
+    def from_ase(cls, atoms, nbeads, nchains, scaling = 1.0):
+        """Builds a state from an ASE atoms object whose atoms are ordered by chain."""
+        cell = np.array(atoms.cell)
+        if cell.size == 3:
+            cell = cell*np.eye(3)
+        return cls(cell*scaling, atoms.get_positions().reshape(nchains,nbeads,3)*scaling)
+
+    def copy(self):
+        return WalkerState(self.cell.copy(), self.coords.copy())
+
+    def to_ase(self, scaling = 1.0):
+        """Returns:
+            box_config: ASE atoms object of the walker, scaled by scaling."""
+        nchains, nbeads, _ = self.coords.shape
+        return Atoms("C"+str(nbeads*nchains), positions=self.coords.reshape(-1,3)*scaling, pbc=True, cell=self.cell*scaling)
+
+def get_walker_state(ibox, nbeads, nchains, out = None):
+    """Copies the state of a simulation box.
+    Arguments:
+        ibox: Simulation box to copy.
+        out: `WalkerState` to copy into, e.g. views of a larger array, a new one if None.
+    Returns:
+        state: `WalkerState` of the box."""
+    if out is None:
+        out = WalkerState.empty(nbeads, nchains)
+    out.cell[:] = alk.box_get_cell(int(ibox))
+    for ichain in range(nchains):
+        out.coords[ichain] = alk.alkane_get_chain(ichain+1,int(ibox))
+    return out
+
+def set_walker_state(ibox, state):
+    """Sets the state of a simulation box from a `WalkerState`."""
+    alk.box_set_cell(int(ibox),state.cell)
+    for ichain in range(len(state.coords)):
+        alk.alkane_get_chain(ichain+1,int(ibox))[:] = state.coords[ichain]
+
 def mk_ase_config(ibox, Nbeads, Nchains, scaling = 3.75):
     """Uses the current state of the alkane model to construct an ASE atoms object.
         Arguments:
@@ -38,19 +89,7 @@ def mk_ase_config(ibox, Nbeads, Nchains, scaling = 3.75):
         Returns:
             box_config: ASE atoms object"""
     
-    # Create and populate ASE object
-    model_positions = np.empty([Nchains*Nbeads, 3])
-    cell_vectors = alk.box_get_cell(int(ibox))
-   
-    for ichain in range(0, Nchains):
-        model_positions[Nbeads*ichain:Nbeads*ichain+Nbeads] = alk.alkane_get_chain(int(ichain+1), int(ibox))
-    
-    confstring = "C"+str(Nbeads*Nchains)
-    
-    box_config = Atoms(confstring, positions=model_positions*scaling, pbc=True, cell=cell_vectors*scaling)
-
-
-    return box_config  # Returns ASE atom object
+    return get_walker_state(ibox, Nbeads, Nchains).to_ase(scaling)  # Returns ASE atom object
 
 def vis_chains(vis_config, nbeads, nchains):
     """Takes an ASE atoms object or list thereof and creates a customised ngl viewer 
@@ -376,8 +415,7 @@ dshear = 1.0, dstretch = 1.0, min_ang = 60, min_ar = 0.8,pressure = 0, two_phase
 
                 else:
                     #reject the move
-                    for ibead in range(nbeads):
-                        current_chain[ibead] = backup_chain[ibead]
+                    current_chain[:] = backup_chain
 
             imove += 1
         isweeps +=1
@@ -492,8 +530,7 @@ dshear = 1.0, dstretch = 1.0, min_ang = 60, min_ar = 0.8,pressure = 0, chain_lis
 
                 else:
                     #reject the move
-                    for ibead in range(nbeads):
-                        current_chain[ibead] = backup_chain[ibead]
+                    current_chain[:] = backup_chain
 
             imove += 1
         isweeps +=1
@@ -508,21 +545,10 @@ dshear = 1.0, dstretch = 1.0, min_ang = 60, min_ar = 0.8,pressure = 0, chain_lis
         return alk.box_compute_volume(int(ibox)), moves_acceptance_rate
       
 def clone_walker(ibox_source,ibox_clone):
-    
-    nbeads  = alk.alkane_get_nbeads()
+    """Copies the state of one simulation box into another."""
     nchains = alk.alkane_get_nchains()
-    
-
-    cell = alk.box_get_cell(ibox_source)
-
-    
-    alk.box_set_cell(ibox_clone,cell)
-    for ichain in range(1,nchains+1):
-        original_chain = alk.alkane_get_chain(ichain,ibox_source)
-        clone_chain = alk.alkane_get_chain(ichain,ibox_clone)
-        for ibead in range(nbeads):
-            clone_chain[ibead][:] = original_chain[ibead][:]
-      
+    nbeads = len(alk.alkane_get_chain(1,int(ibox_source)))
+    set_walker_state(ibox_clone, get_walker_state(ibox_source, nbeads, nchains))
 
 def perturb_initial_configs(ns_data, move_ratio, walk_length = 20):
     
@@ -563,19 +589,7 @@ def import_ase_to_ibox(atoms, ibox, ns_data, scaling = 1.0):
         nchains = ns_data["nchains"]
 
 
-    cell_vectors = atoms.cell
-
-    if cell_vectors.size == 3:
-        cell_vectors *= np.eye(3)
-    alk.box_set_cell(int(ibox),cell_vectors*scaling)
-
-    positions = atoms.get_positions()
-
-    for ichain in range(1,nchains+1):
-        chain = alk.alkane_get_chain(ichain,int(ibox))
-        for ibead in range(nbeads):
-            chain[ibead][:] = positions[(ichain-1)*nbeads+ibead][:]*scaling
-
+    set_walker_state(ibox, WalkerState.from_ase(atoms, nbeads, nchains, scaling))
 
     return
 
@@ -593,7 +607,7 @@ def initialise_sim_cells(args, quiet):
 
     # alk.random_set_random_seed(1)
     alk.box_set_quiet(quiet)
-    alk.box_set_num_boxes(args["nwalkers"]) #nwalkers+2 if debugging
+    alk.box_set_num_boxes(args.get("nboxes",args["nwalkers"])) #nwalkers+2 if debugging
     alk.box_initialise()
     alk.box_set_pbc(1)
     alk.alkane_set_nchains(int(args["nchains"]))
@@ -632,30 +646,148 @@ def create_initial_configs(args, max_vol_per_atom = 15):
     populate_boxes(args)
 
 def populate_boxes(args):
-    ncopy = args["nchains"]
     for ibox in range(1,args["nwalkers"]+1):
-        for ichain in range(1,ncopy+1):
-            rb_factor = 0
-            alk.alkane_set_nchains(ichain)
-            overlap_flag = 1
-            while rb_factor == 0:
-                rb_factor, ifail = alk.alkane_grow_chain(ichain,int(ibox),1) 
-                if ifail != 0:
-                    rb_factor = 0
+        populate_box(ibox,args["nchains"])
+
+def populate_box(ibox, nchains, max_attempts = None):
+    """Grows every chain of a simulation box from scratch, placing each new chain at random and
+    retrying until it does not overlap the chains already placed.
+    Arguments:
+        ibox: Simulation box to populate.
+        nchains: Number of chains to grow.
+        max_attempts: Number of attempts allowed per chain, unlimited if None.
+    Returns:
+        success: False if a chain could not be placed within max_attempts."""
+    success = True
+    for ichain in range(1,nchains+1):
+        rb_factor = 0
+        alk.alkane_set_nchains(ichain)
+        attempts = 0
+        while rb_factor == 0:
+            if max_attempts is not None and attempts >= max_attempts:
+                success = False
+                break
+            rb_factor, ifail = alk.alkane_grow_chain(ichain,int(ibox),1) 
+            if ifail != 0:
+                rb_factor = 0
+            attempts += 1
+        if not success:
+            break
+    alk.alkane_set_nchains(nchains)
+    return success
+
+def cell_shape_limits(cells):
+    """Computes the quantities the cell shape constraints apply to, as `min_aspect_ratio` and `min_angle` do
+    for a simulation box, for any number of cells at once.
+    Arguments:
+        cells: (...,3,3) array of cell vectors as rows.
+    Returns:
+        aspect: Shortest distance between two parallel faces of each cell normalised to unit volume.
+        angle: Smallest angle in radians between two cell vectors of each cell."""
+    cells = np.asarray(cells)
+    vol = np.abs(np.linalg.det(cells))
+    areas = np.stack([np.linalg.norm(np.cross(cells[...,(i+1)%3,:],cells[...,(i+2)%3,:]),axis=-1) for i in range(3)],axis=-1)
+    aspect = vol/areas.max(axis=-1)/np.cbrt(vol)
+    lengths = np.linalg.norm(cells,axis=-1)
+    cos = np.stack([np.abs((cells[...,(i+1)%3,:]*cells[...,(i+2)%3,:]).sum(axis=-1))/(lengths[...,(i+1)%3]*lengths[...,(i+2)%3])
+                    for i in range(3)],axis=-1)
+    angle = np.arccos(np.minimum(cos.max(axis=-1),1.0))
+    return aspect, angle
+
+def random_cell(volume, min_ar = 0.8, min_ang = 60, ibox = 1, block = 4096):
+    """Draws a random cell of a given volume uniformly among the shapes allowed by the cell shape constraints,
+    i.e. from the distribution the shear and stretch moves of `MC_run` leave the shape in, which is the
+    Lebesgue measure on the cell matrix restricted to the volume.
+    Cells are drawn in the lower triangular form ASE uses, since the constraints do not depend on orientation.
+    For unit volume the cell vectors are no longer than 1/(min_ar^2 sin(min_ang)), so the five free components are
+    drawn uniformly within that bound, the last diagonal component fixes the volume, and shapes are accepted with
+    probability proportional to the first component, the Jacobian of the triangular form, if they satisfy the constraints.
+    Arguments:
+        volume: Volume of the cell.
+        min_ar: Smallest allowed distance between parallel faces for the cell normalised to unit volume.
+        min_ang: Smallest allowed angle in degrees between two cell vectors.
+        ibox: Simulation box in which the cell is set.
+        block: Number of shapes tried at once.
+    Returns:
+        cell: The accepted cell, which is also set on ibox."""
+    if min_ar <= 0 or min_ang <= 0:
+        raise ValueError("cell shapes can only be drawn uniformly with a positive min_aspect_ratio and min_angle")
+    min_ang_rad = min_ang*np.pi/180
+    lmax = 1.0/(min_ar**2*np.sin(min_ang_rad))
+    while True:
+        shapes = np.zeros((block,3,3))
+        shapes[:,0,0] = np.random.uniform(0,lmax,block)
+        shapes[:,1,:2] = np.random.uniform([-lmax,0],lmax,(block,2))
+        shapes[:,2,:2] = np.random.uniform(-lmax,lmax,(block,2))
+        shapes[:,2,2] = 1.0/(shapes[:,0,0]*shapes[:,1,1])
+        aspect, angle = cell_shape_limits(shapes)
+        accepted = np.flatnonzero((aspect >= min_ar) & (angle >= min_ang_rad) & (np.random.random(block)*lmax < shapes[:,0,0]))
+        if len(accepted):
+            cell = shapes[accepted[0]]*np.cbrt(volume)
+            alk.box_set_cell(int(ibox),cell)
+            return cell
+
+def grow_walker(ibox, nchains):
+    """Grows every chain of a simulation box from scratch with a single attempt each, keeping a chain with
+    probability equal to its Rosenbluth factor, which is the product over its beads of the fraction of trial
+    positions free of overlaps. This undoes the bias of configurational bias growth towards chains which fit,
+    so a walker which is kept is uniformly distributed among the configurations without overlaps.
+    Arguments:
+        ibox: Simulation box to populate.
+        nchains: Number of chains to grow.
+    Returns:
+        success: False if a chain overlapped or was not kept, in which case the whole walker has to be redrawn."""
+    success = True
+    for ichain in range(1,nchains+1):
+        alk.alkane_set_nchains(ichain)
+        rb_factor, ifail = alk.alkane_grow_chain(ichain,int(ibox),1)
+        if ifail != 0 or np.random.random() >= rb_factor:
+            success = False
+            break
+    alk.alkane_set_nchains(nchains)
+    return success
+
+def create_prior_configs(args, max_vol_per_atom = 15, max_attempts = 1000, boxes = None):
+    """Initialises every walker with an independent draw from the prior, removing the need for equilibration
+    sweeps before the run. Each walker gets a volume drawn from p(V) ~ V^nchains below the starting volume of
+    nbeads*nchains*max_vol_per_atom, a cell shape drawn uniformly within the shape constraints by `random_cell`,
+    and chains which are independently placed, oriented and grown by `grow_walker`. If any chain overlaps, the whole
+    walker, volume and cell included, is drawn again, so the draws are exact. The fraction of walkers kept falls
+    off exponentially with the number of chains, which makes exact draws impractical for large systems.
+    With prior_init_approximate set, chains are instead retried one at a time until they fit among those already
+    placed, which is much faster but biases the configurations the way random sequential adsorption does.
+    Arguments:
+        args: Dictionary of simulation parameters.
+        max_vol_per_atom: Volume per bead of the largest cell.
+        max_attempts: Attempts allowed to place a chain before a new walker is drawn, for approximate draws only.
+        boxes: Simulation boxes to initialise, all walkers if None."""
+    nchains = args["nchains"]
+    max_vol = args["nbeads"]*nchains*max_vol_per_atom
+    approximate = args.get("prior_init_approximate",False)
+    if boxes is None:
+        boxes = range(1,args["nwalkers"]+1)
+    for ibox in boxes:
+        placed = False
+        while not placed:
+            volume = max_vol*np.random.random()**(1.0/(nchains+1))
+            random_cell(volume, args["min_aspect_ratio"], args["min_angle"], ibox)
+            if approximate:
+                placed = populate_box(ibox, nchains, max_attempts)
+            else:
+                placed = grow_walker(ibox, nchains)
 
 def write_all_to_extxyz(args,filename = "dump.extxyz"):
     """ Writes all simulation boxes to an extxyz file:
     Arguments:
         filename: Name of file to output configurations to."""
     
-    for i in range(1,args["nwalkers"]+1):
-        atoms = mk_ase_config(i,args["nbeads"],args["nchains"])
-        io.write(filename, atoms,format="extxyz", append = True)
+    configs = [mk_ase_config(i,args["nbeads"],args["nchains"]) for i in range(1,args["nwalkers"]+1)]
+    io.write(filename, configs,format="extxyz", append = True) #one write rather than reopening the file per walker
 
     return
 
 def adjust_mc_steps(args,comm,move_ratio,vol_max,walklength = 10, lower_bound = 0.2, upper_bound=0.5, 
-                      min_dstep=1e-5*np.ones(6), dv_max=10.0,dr_max=10.0, dshear = 1.0, dstretch=1.0): 
+                      min_dstep=1e-5*np.ones(6), dv_max=10.0,dr_max=10.0, dshear = 1.0, dstretch=1.0, walkers=None): 
 
     """Adjusts the size of the MC steps being performed on a box in order to correspond with a set acceptance rate, by performing MC runs on the boxes
         using only one move type.
@@ -664,6 +796,7 @@ def adjust_mc_steps(args,comm,move_ratio,vol_max,walklength = 10, lower_bound =
             clone: Which simulation box to use to initialise the system on which the MC run is performed.
             active_box: Which simulation box to use to perform the runs on which stats are collected for adjusting the rate.
             volume_limit: The volume limit to be used when determining the acceptance rate of volume moves.
+            walkers: Indices of the walkers which may be used for the trial runs, all walkers if None.
         Returns:
             rates: An array containing the acceptance rate for each type of MC move.
 
@@ -673,16 +806,20 @@ def adjust_mc_steps(args,comm,move_ratio,vol_max,walklength = 10, lower_bound =
     size = comm.Get_size()
     rate = np.zeros(6)
     avg_rate = np.zeros_like(rate)
-    mc_box = np.random.randint(args["nwalkers"])
+    if walkers is None:
+        mc_box = np.random.randint(args["nwalkers"])
+    else:
+        mc_box = walkers[np.random.randint(len(walkers))]
 
+    backup = WalkerState.empty(args["nbeads"],args["nchains"])
     for i in range(6):
         move_ratio_matrix = np.eye(6)
-        backup = mk_ase_config(mc_box+1,args["nbeads"],args["nchains"],scaling=1)
         if move_ratio[i] != 0:
+            get_walker_state(mc_box+1,args["nbeads"],args["nchains"],out=backup)
             rate += MC_run(args,walklength, move_ratio_matrix[i],mc_box+1,vol_max,dshear=dshear, dstretch=dstretch,
             min_ang = args["min_angle"], min_ar=args["min_aspect_ratio"])[1]
-            import_ase_to_ibox(backup,mc_box+1,args)
-    comm.Allreduce(rate,avg_rate,op=MPI.SUM)
+            set_walker_state(mc_box+1,backup)
+    comm.Allreduce(rate,avg_rate) #summed over ranks
     avg_rate = avg_rate/size
     if move_ratio[0] != 0:
         if avg_rate[0] < lower_bound:
@@ -1,9 +1,16 @@
 import h5py
 from NesSa import MCNS as NS
-from mpi4py import MPI
+from NesSa import rng
+from NesSa import samplelog
+from NesSa import outindex
+from NesSa import h5traj
+from NesSa import snapshot
 import argparse
+import io
+import os
 import sys
 import ase.io
+import numpy as np
 
 def parse_args():
 
@@ -32,9 +39,9 @@ def read_hans_file(filename = None):
         if (not line.startswith('#') and line != ''):
             key,value=line.split("=")
             data[key.strip()] = value.strip()
-    float_keys = ["bondlength","bondangle","min_angle","min_aspect_ratio", "pressure", "upper_bound", "lower_bound", "time"]
-    int_keys = ["nchains","nbeads","nwalkers","walklength","initial_walk","analyse", "equil_iter", "main_iter", "index"]
-    bool_keys=["profile"]
+    float_keys = ["bondlength","bondangle","min_angle","min_aspect_ratio", "pressure", "upper_bound", "lower_bound", "time", "max_betaP", "termination_tol", "max_lost_time"]
+    int_keys = ["nchains","nbeads","nwalkers","walklength","initial_walk","analyse", "equil_iter", "main_iter", "index", "decorrelation_sweeps", "walk_workers", "seed", "delta_interval", "max_deltas", "traj_interval", "traj_bits", "snapshot_interval"]
+    bool_keys=["profile", "prior_init", "prior_init_approximate", "shared_store", "async_io", "sample_log", "hdf5_traj", "culled_archive", "restart_float32"]
     for key in float_keys:
         if key in data:
             data[key] = float(data[key])
@@ -60,60 +67,372 @@ def read_hans_file(filename = None):
         data["min_aspect_ratio"] = 0.8
     if not "restart_file" in data:
         data["restart_file"] = "restart.hdf5"
+    if not "termination_tol" in data:
+        data["termination_tol"] = 1e-5
+    if not "max_deltas" in data:
+        data["max_deltas"] = 20
+    if not "max_lost_time" in data:
+        data["max_lost_time"] = 3600.0
+    if not "traj_interval" in data:
+        data["traj_interval"] = 100
 
 
 
     
     return data
 
-def write_to_restart(args,comm,filename = "restart.hdf5",i=0, dshear=None,dstretch = None):
-    size = comm.Get_size()
-    rank = comm.Get_rank()
-    if rank==0:
-        f = h5py.File(filename, "w")
-        for j in args:
-            f.attrs.create(j,args[j])
-        f.attrs.create("prev_iters",i+1)
-        f.attrs.create("dv_max",NS.alk.alkane_get_dv_max())
-        f.attrs.create("dr_max",NS.alk.alkane_get_dr_max())
-        f.attrs.create("dt_max",NS.alk.alkane_get_dt_max())
-        f.attrs.create("dh_max",NS.alk.alkane_get_dh_max())
-        if not dshear is None:
-            f.attrs.create("dshear",dshear)
-            f.attrs.create("dstretch",dstretch)
-
-
-        for iwalker in range(1,args["nwalkers"]+1):
-            groupname = f"walker_{rank}_{iwalker:04d}"
-            tempgrp = f.create_group(groupname)
-            coords = tempgrp.create_dataset("coordinates",(args["nbeads"]*args["nchains"],3),dtype="float64")
-            unitcell = tempgrp.create_dataset("unitcell",(3,3),dtype="float64")
-
-            unitcell[:] = NS.alk.box_get_cell(iwalker)
-            for ichain in range(args["nchains"]):
-                chain = NS.alk.alkane_get_chain(ichain+1,iwalker)
-                coords[ichain*args["nbeads"]:ichain*args["nbeads"]+(args["nbeads"]), :] = chain
-        for j in range(1,size):
-            config_list = comm.recv(source=j,tag = j)
-            for iwalker in range(1,args["nwalkers"]+1):
-                groupname = f"walker_{j}_{iwalker:04d}"
-                tempgrp = f.create_group(groupname)
-                coords = tempgrp.create_dataset("coordinates",(args["nbeads"]*args["nchains"],3),dtype="float64")
-                unitcell = tempgrp.create_dataset("unitcell",(3,3),dtype="float64")
-
-                unitcell[:] = config_list[iwalker-1].cell
-                for ichain in range(args["nchains"]):
-                    coords[:] = config_list[iwalker-1].positions
-        f.close()
+def shard_filename(filename, rank):
+    """Returns:
+        Name of the file holding one rank's walkers for the restart file filename, e.g. restart.rank3.hdf5."""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.rank{rank}{ext}"
+
+def delta_filename(filename, k):
+    """Returns:
+        Name of the k-th delta checkpoint following the restart file filename, e.g. restart.delta2.hdf5."""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.delta{k}{ext}"
+
+def _shard_data(nbeads, nchains, boxes, active, scheduler, index = None, float32 = False):
+    """Copies the given simulation boxes of this rank, with its walker flags and random stream, so later changes
+    to them do not affect a shard which is still being written. If float32, coordinates are kept in single precision.
+    Returns:
+        data: Dictionary of the arrays to write.
+        rng_state: State of this rank's random stream."""
+    cells = np.empty((len(boxes),3,3))
+    coords = np.empty((len(boxes),nbeads*nchains,3))
+    for j, ibox in enumerate(boxes):
+        NS.get_walker_state(ibox,nbeads,nchains,out=NS.WalkerState(cells[j],coords[j].reshape(nchains,nbeads,3)))
+    data = {}
+    if index is not None:
+        data["index"] = index
+    data["unitcell"] = cells
+    data["coordinates"] = coords.astype(np.float32) if float32 else coords
+    data["active"] = np.array(active,dtype=bool)
+    if scheduler is not None:
+        data["last_walked"] = scheduler.last_walked.copy()
+        data["sweeps_since_clone"] = scheduler.sweeps_since_clone.copy()
+    return data, rng.get_state()
+
+def _save_shard(name, data, rng_state):
+    """Writes a shard file from the arrays returned by `_shard_data`."""
+    with h5py.File(name, "w") as shard:
+        for key in data:
+            shard.create_dataset(key,data=data[key],compression="gzip",compression_opts=1,shuffle=True)
+        rng.write_state(shard.create_group("rng"),rng_state)
+
+def _step_attrs(i, dshear, dstretch):
+    """Returns:
+        attrs: Dictionary of the iteration counter and current MC step sizes, as stored in a restart manifest."""
+    attrs = {"prev_iters": i+1,
+             "dv_max": NS.alk.alkane_get_dv_max(),
+             "dr_max": NS.alk.alkane_get_dr_max(),
+             "dt_max": NS.alk.alkane_get_dt_max(),
+             "dh_max": NS.alk.alkane_get_dh_max()}
+    if not dshear is None:
+        attrs["dshear"] = dshear
+        attrs["dstretch"] = dstretch
+    return attrs
+
+def _save_manifest(filename, attrs):
+    with h5py.File(filename, "w") as f:
+        for key in attrs:
+            f.attrs.create(key,attrs[key])
+
+def _save_delta_manifest(filename, k, attrs):
+    _save_manifest(delta_filename(filename,k),attrs)
+    with h5py.File(filename, "a") as f:
+        f.attrs["ndeltas"] = k
+
+def write_to_restart(args,comm,filename = "restart.hdf5",i=0, dshear=None,dstretch = None, active = None, scheduler = None, writer = None):
+    """Writes a full checkpoint of the run. Every rank writes its own walkers to a shard file as contiguous arrays,
+    and once all shards are complete rank 0 writes filename itself, a small manifest holding the simulation
+    parameters, step sizes and number of shards. Nothing is sent between ranks.
+        Arguments:
+            i: Current iteration, the run is continued from i+1.
+            active: Which walkers on this rank are live, all if None.
+            scheduler: `WalkerScheduler` whose counters are saved with the walkers.
+            writer: Optional `AsyncWriter`. If given, the shard is written in the background and the checkpoint is
+                    only complete once `commit_restart` is called with the returned value.
+        Returns:
+            pending: The manifest still to be written when a writer is given, None otherwise."""
+    nboxes = args.get("nboxes",args["nwalkers"])
+    if active is None:
+        active = np.ones(nboxes,dtype=bool)
+    data, rng_state = _shard_data(args["nbeads"],args["nchains"],range(1,nboxes+1),active,scheduler,
+                                  float32=args.get("restart_float32",False))
+    attrs = dict(args)
+    attrs.update(nranks = comm.Get_size(), ndeltas = 0)
+    attrs.update(_step_attrs(i,dshear,dstretch))
+    return _write_checkpoint(comm,shard_filename(filename,comm.Get_rank()),data,rng_state,
+                             (_save_manifest,filename,attrs),writer)
+
+def write_restart_delta(args, comm, filename, k, changed, i=0, dshear=None, dstretch=None, active=None, scheduler=None, writer=None):
+    """Adds a delta checkpoint to the full checkpoint filename, holding only the walkers changed since the previous
+    checkpoint, full or delta, together with the walker flags, random streams, step sizes and iteration counter.
+    The delta only counts once rank 0 has recorded it in the manifest of filename, so an interrupted write
+    leaves the previous chain intact.
+        Arguments:
+            k: Number of the delta, one more than the number of deltas already following filename.
+            changed: (nboxes,) array, True for the walkers on this rank changed since the previous checkpoint.
+            Others as for `write_to_restart`.
+        Returns:
+            pending: As for `write_to_restart`."""
+    nboxes = args.get("nboxes",args["nwalkers"])
+    if active is None:
+        active = np.ones(nboxes,dtype=bool)
+    index = np.flatnonzero(changed)
+    data, rng_state = _shard_data(args["nbeads"],args["nchains"],index+1,active,scheduler,index=index,
+                                  float32=args.get("restart_float32",False))
+    return _write_checkpoint(comm,shard_filename(delta_filename(filename,k),comm.Get_rank()),data,rng_state,
+                             (_save_delta_manifest,filename,k,_step_attrs(i,dshear,dstretch)),writer)
+
+def _write_checkpoint(comm, shard_name, data, rng_state, manifest, writer):
+    """Writes this rank's shard of a checkpoint, then the manifest once every rank's shard is complete, unless the
+    shard is handed to a background writer, in which case the manifest is returned for `commit_restart`."""
+    if writer is not None:
+        writer.submit(_save_shard,shard_name,data,rng_state)
+        return manifest
+    _save_shard(shard_name,data,rng_state)
+    commit_restart(comm,manifest)
+
+def commit_restart(comm, pending, writer = None):
+    """Completes a checkpoint whose shards were handed to a background writer. Waits for this rank's writes to
+    finish, and once every rank's have, rank 0 writes the manifest which makes the checkpoint usable.
+        Arguments:
+            pending: Value returned by `write_to_restart` or `write_restart_delta`."""
+    if writer is not None:
+        writer.flush()
+    comm.Barrier() #the manifest only appears once every shard is complete
+    if comm.Get_rank() == 0:
+        func, *func_args = pending
+        func(*func_args)
+
+def _restart_counts(filename):
+    """Returns:
+        nranks: Number of shards of the restart file, 0 for restart files written before checkpoints were sharded.
+        ndeltas: Number of delta checkpoints following it."""
+    with h5py.File(filename, "r") as f:
+        return int(f.attrs.get("nranks",0)), int(f.attrs.get("ndeltas",0))
+
+def restart_members(filename, base = None):
+    """Returns:
+        names: Every file belonging to the restart file filename other than itself, i.e. its shards and its delta
+               checkpoints with their shards. If base is given, the names the same files take for the restart file base."""
+    nranks, ndeltas = _restart_counts(filename)
+    base = filename if base is None else base
+    names = [shard_filename(base,r) for r in range(nranks)]
+    for k in range(1,ndeltas+1):
+        names.append(delta_filename(base,k))
+        names += [shard_filename(delta_filename(base,k),r) for r in range(nranks)]
+    return names
+
+def _latest_shard(filename, r, ndeltas):
+    """Returns:
+        Name of the most recent shard, full or delta, written by rank r for the restart file filename."""
+    return shard_filename(delta_filename(filename,ndeltas) if ndeltas else filename, r)
+
+def restart_attrs(filename):
+    """Returns:
+        attrs: Dictionary of the attributes of a restart file, with the iteration counter and step sizes of its
+               latest delta checkpoint if it has any."""
+    with h5py.File(filename, "r") as f:
+        attrs = dict(f.attrs)
+    ndeltas = int(attrs.get("ndeltas",0))
+    if ndeltas:
+        with h5py.File(delta_filename(filename,ndeltas), "r") as f:
+            attrs.update(f.attrs)
+    return attrs
+
+def rotate_restart(filename = "restart.hdf5", backup = "restart_backup.hdf5"):
+    """Replaces the backup restart file, with its shards and deltas, by the current one. Called on rank 0 only."""
+    if os.path.exists(backup):
+        for name in restart_members(backup):
+            if os.path.exists(name):
+                os.remove(name)
+        os.remove(backup)
+    if os.path.exists(filename):
+        for name, new_name in zip(restart_members(filename),restart_members(filename,backup)):
+            os.rename(name,new_name)
+        os.rename(filename,backup)
+
+def _legacy_walker_groups(f):
+    """Returns:
+        groups: For each rank of a run which wrote every walker into the restart file as a walker_{rank}_{iwalker}
+                group, the names of its groups in order."""
+    groups = {}
+    for name in f:
+        if name.startswith("walker_"):
+            _, rank, iwalker = name.split("_")
+            groups.setdefault(int(rank),[]).append((int(iwalker),name))
+    return [[name for _, name in sorted(groups[rank])] for rank in sorted(groups)]
+
+def read_saved_rank(filename, r, index = slice(None)):
+    """Reads walkers saved by one rank of a previous run, applying any delta checkpoints in order.
+    Arguments:
+        filename: Restart file.
+        r: Rank of the previous run.
+        index: Which of that rank's walkers to read, as an increasing list or a slice.
+    Returns:
+        data: Dictionary of the arrays "unitcell", "coordinates" and "active", and of "last_walked" and
+              "sweeps_since_clone" if they were saved, with one entry per walker."""
+    nranks, ndeltas = _restart_counts(filename)
+    if nranks:
+        with h5py.File(shard_filename(filename,r), "r") as shard:
+            data = {key: shard[key][:] for key in shard if isinstance(shard[key], h5py.Dataset)}
+        for k in range(1,ndeltas+1):
+            with h5py.File(shard_filename(delta_filename(filename,k),r), "r") as delta:
+                changed = delta["index"][:]
+                for key in delta:
+                    if key == "unitcell" or key == "coordinates":
+                        data[key][changed] = delta[key][:]
+                    elif key != "index" and isinstance(delta[key], h5py.Dataset):
+                        data[key] = delta[key][:]
+        return {key: value[index] for key, value in data.items()}
+    with h5py.File(filename, "r") as f:
+        names = np.array(_legacy_walker_groups(f)[r])[index]
+        data = {"unitcell": np.array([f[name]["unitcell"][:] for name in names]).reshape(-1,3,3),
+                "coordinates": np.array([f[name]["coordinates"][:] for name in names]),
+                "active": np.array([f[name].attrs.get("active",True) for name in names],dtype=bool)}
+        if len(names) and "last_walked" in f[names[0]].attrs:
+            for key in ["last_walked","sweeps_since_clone"]:
+                data[key] = np.array([f[name].attrs[key] for name in names])
+    return data
+
+def saved_active(filename):
+    """Returns:
+        actives: For each rank of the run which wrote the restart file, which of its walkers were live."""
+    nranks, ndeltas = _restart_counts(filename)
+    if nranks:
+        actives = []
+        for r in range(nranks):
+            with h5py.File(_latest_shard(filename,r,ndeltas), "r") as shard:
+                actives.append(shard["active"][:])
+        return actives
+    with h5py.File(filename, "r") as f:
+        return [np.array([f[name].attrs.get("active",True) for name in names],dtype=bool) for names in _legacy_walker_groups(f)]
+
+def restart_boxes_per_rank(filename, size):
+    """Returns:
+        nboxes: Number of simulation boxes each of size ranks needs to hold the walkers of the restart file."""
+    actives = saved_active(filename)
+    if len(actives) == size:
+        return len(actives[0])
+    n_live = sum(int(a.sum()) for a in actives)
+    return -(-n_live//size)
+
+def read_restart_walkers(filename, comm):
+    """Reads this rank's walkers from a restart file. On the same number of ranks as the run which
+    wrote it, every rank reads back its own walkers. Otherwise the live walkers are treated as one
+    population, shared out in contiguous blocks as evenly as possible over the ranks of comm.
+    Returns:
+        cells: (n_local,3,3) array of cell vectors.
+        coords: (n_local,natoms,3) array of bead positions.
+        active: (n_local,) array, True for live walkers.
+        sched_state: (2,n_local) array of the scheduler's last_walked and sweeps_since_clone, or None
+                     if the file does not hold them."""
+    actives = saved_active(filename)
+    if len(actives) == comm.Get_size():
+        parts = [read_saved_rank(filename,comm.Get_rank())]
     else:
-        config_list=[NS.mk_ase_config(ibox+1,args["nbeads"],args["nchains"],1.0) for ibox in range(args["nwalkers"])]
-        comm.ssend(config_list,0,tag=rank)
-    return
+        live = [(r,j) for r, a in enumerate(actives) for j in np.flatnonzero(a)]
+        block = np.array_split(np.arange(len(live)),comm.Get_size())[comm.Get_rank()]
+        by_rank = {}
+        for k in block:
+            by_rank.setdefault(live[k][0],[]).append(int(live[k][1]))
+        parts = [read_saved_rank(filename,r,index) for r, index in sorted(by_rank.items())]
+    if not parts:
+        return np.empty((0,3,3)), np.empty((0,0,3)), np.empty(0,dtype=bool), None
+    cells = np.concatenate([p["unitcell"] for p in parts])
+    coords = np.concatenate([p["coordinates"] for p in parts])
+    active = np.concatenate([p["active"] for p in parts]).astype(bool)
+    sched_state = None
+    if all("last_walked" in p for p in parts):
+        sched_state = np.array([np.concatenate([p[key] for p in parts]) for key in ["last_walked","sweeps_since_clone"]])
+    return cells, coords, active, sched_state
+
+def revalidate_walkers(active):
+    """Checks the live walkers loaded from a restart file for overlaps, which coordinates saved in single precision
+    can introduce between beads that were in contact. Each overlapping walker is replaced by a copy of a random
+    valid walker on this rank, as if it had been culled.
+    Arguments:
+        active: Which of the loaded walkers, held in boxes 1 onwards, are live.
+    Returns:
+        n_replaced: Number of walkers replaced."""
+    live = np.flatnonzero(active)
+    overlapping = [iwalker for iwalker in live if NS.alk.alkane_check_chain_overlap(int(iwalker+1))]
+    if not overlapping:
+        return 0
+    valid = np.setdiff1d(live,overlapping)
+    if len(valid) == 0:
+        raise RuntimeError("Every walker loaded from the restart file overlaps, restart from a file saved in double precision")
+    for iwalker in overlapping:
+        NS.clone_walker(int(valid[np.random.randint(len(valid))]+1),int(iwalker+1))
+    return len(overlapping)
+
+def read_restart_rng(filename, comm):
+    """Restores this rank's random stream from its shard of a restart file.
+    Returns:
+        True if the file was written by the same number of ranks and holds the streams. A run restarted on a
+        different number of ranks walks different walkers on each rank, so the streams are not reused."""
+    nranks, ndeltas = _restart_counts(filename)
+    if nranks != comm.Get_size():
+        return False
+    with h5py.File(_latest_shard(filename,comm.Get_rank(),ndeltas), "r") as shard:
+        if "rng" not in shard:
+            return False
+        rng.read_state(shard["rng"])
+    return True
 
-def write_to_extxyz(args,ibox=1,filename="traj.extxyz", parallel = False):
+def read_initial_configs(filename, comm, nbeads, nchains):
+    """Reads every frame of a configuration file once on rank 0 and broadcasts them to all ranks as arrays.
+    Arguments:
+        filename: Any file ASE can read, possibly containing several frames.
+        comm: Communicator of the run.
+        nbeads: Number of beads per chain.
+        nchains: Number of chains.
+    Returns:
+        cells: (nframes,3,3) array of cell vectors.
+        positions: (nframes,nchains*nbeads,3) array of bead positions."""
+    rank = comm.Get_rank()
+    natoms = nchains*nbeads
+    header = None
+    if rank == 0:
+        try:
+            frames = ase.io.read(filename, index=":")
+        except OSError:
+            print(f"Cannot locate {filename}")
+            frames = []
+        for atoms in frames:
+            if len(atoms) != natoms:
+                print(f"Initial config has wrong number of atoms, {len(atoms)} instead of {natoms}")
+                frames = []
+                break
+        header = len(frames)
+    nframes = comm.bcast(header, root=0)
+    if nframes == 0:
+        sys.exit(1)
+
+    cells = np.empty((nframes,3,3))
+    positions = np.empty((nframes,natoms,3))
+    if rank == 0:
+        for iframe, atoms in enumerate(frames):
+            cell_vectors = np.array(atoms.get_cell())
+            if cell_vectors.size == 3:
+                cell_vectors = cell_vectors*np.eye(3)
+            cells[iframe] = cell_vectors
+            positions[iframe] = atoms.get_positions()
+    comm.Bcast(cells, root=0)
+    comm.Bcast(positions, root=0)
+    return cells, positions
+
+def write_to_extxyz(args,ibox=1,filename="traj.extxyz", parallel = False, writer = None, iteration = None):
     """Writes a single simulation box to file.
         Arguments:
-            ibox: Simulation box to write. If none, the largest simulation box is used."""
+            ibox: Simulation box to write. If none, the largest simulation box is used.
+            writer: Optional `AsyncWriter`, which writes a copy of the box in the background.
+            iteration: Iteration the box is written at. If given, the frame is tagged with it and indexed,
+                       so it can be found with `read_frame` and dropped by `restart_cleanup` without rereading the file."""
     nbeads = args["nbeads"]
     nchains = args["nchains"]
 
@@ -121,24 +440,124 @@ def write_to_extxyz(args,ibox=1,filename="traj.extxyz", parallel = False):
     max_vol_config = NS.mk_ase_config(ibox,nbeads,nchains, scaling = 1.0)
     max_vol_config.wrap()
 
+    if iteration is not None:
+        max_vol_config.info["iter"] = int(iteration)
+        if writer is not None:
+            writer.submit(_append_frame, filename, max_vol_config, iteration)
+            return
+        _append_frame(filename, max_vol_config, iteration)
+        return
+    if writer is not None:
+        writer.submit(NS.io.write, filename, max_vol_config, append = True, parallel=parallel)
+        return
     NS.io.write(filename, max_vol_config, append = True, parallel=parallel)
     return
 
-def restart_cleanup(args,traj_interval=100):
-    old_vol_file = open("volumes.txt", "r+")
-    lines  = old_vol_file.readlines()
-    old_vol_file.close()
-    if (len(lines) - 1) > args["prev_iters"]:
+def _append_frame(filename, config, iteration):
+    """Appends a configuration to an extxyz file and adds its offset to the file's index.
+    Only one process may append to a file, each rank writes its own, named by `shard_filename`."""
+    with open(filename, "ab") as f:
+        offset = f.tell()
+        text = io.StringIO()
+        ase.io.write(text, config, format = "extxyz", parallel = False)
+        f.write(text.getvalue().encode())
+    outindex.append_entries(filename, np.array([(iteration, offset)], dtype=outindex.index_dtype))
+
+def write_to_hdf5_traj(args, ibox, traj, iteration, volume):
+    """Adds a simulation box to one of this rank's HDF5 trajectories, traj.hdf5 or the archive of culled walkers.
+        Arguments:
+            ibox: Simulation box to write.
+            traj: Open `h5traj.TrajectoryWriter` of this rank.
+            iteration: Iteration the box is written at.
+            volume: Volume of the box."""
+    state = NS.get_walker_state(ibox,args["nbeads"],args["nchains"])
+    traj.append(iteration, volume, state.cell, state.coords)
+
+def write_snapshot(args, comm, filename, active, scheduler = None):
+    """Writes every simulation box on every rank into one snapshot file, each rank writing its own block of records.
+    Must be called on every rank.
+        Arguments:
+            filename: Snapshot file to write, e.g. snapshot.1000.npy.
+            active: Which walkers on this rank are live.
+            scheduler: `WalkerScheduler` whose counters give the age and last walk of each walker."""
+    nbeads, nchains = args["nbeads"], args["nchains"]
+    nboxes = args.get("nboxes",args["nwalkers"])
+    rank = comm.Get_rank()
+    if rank == 0:
+        snapshot.create(filename,snapshot.record_dtype(nbeads,nchains),comm.Get_size()*nboxes)
+    records = np.zeros(nboxes,dtype=snapshot.record_dtype(nbeads,nchains))
+    records["rank"] = rank
+    records["index"] = np.arange(nboxes)
+    records["active"] = active
+    if scheduler is not None:
+        records["age"] = scheduler.sweeps_since_clone
+        records["last_walked"] = scheduler.last_walked
+    else:
+        records["age"] = records["last_walked"] = -1
+    cells, coords = records["cell"], records["coordinates"]
+    for j in range(nboxes):
+        records["volume"][j] = NS.alk.box_compute_volume(j+1)
+        NS.get_walker_state(j+1,nbeads,nchains,out=NS.WalkerState(cells[j],coords[j]))
+    comm.Barrier() #the file exists at its full size
+    snapshot.write_records(filename,rank*nboxes,records)
+    comm.Barrier()
+
+def read_frame(iteration, filename="traj.extxyz"):
+    """Reads the frame written at a given iteration from an indexed trajectory, without reading the frames before it.
+    Searches the file of every rank, traj.rank<N>.extxyz for traj.extxyz, then filename itself if it was merged.
+    Returns:
+        config: ASE atoms object."""
+    for name in outindex.shards(filename) + [filename]:
+        if not os.path.exists(name):
+            continue
+        try:
+            offset = outindex.offset_of(name, iteration)
+        except KeyError:
+            continue
+        with open(name, "r") as f:
+            f.seek(offset)
+            return ase.io.read(f, index = 0, format = "extxyz", parallel = False)
+    raise KeyError(f"iteration {iteration} is not indexed in {filename} or its per rank files")
+
+def restart_cleanup(args,traj_interval=100,volumes_file="volumes.txt"):
+    """Drops the samples and trajectory frames written after the checkpoint a run restarts from.
+    Indexed files are truncated in place, older files without an index are read and rewritten."""
+    cutoff = args["prev_iters"]
+    if samplelog.is_sample_log(volumes_file):
+        truncated = samplelog.truncate_sample_log(volumes_file,cutoff)
+    else:
+        truncated = outindex.truncate(volumes_file,cutoff,outindex.scan_lines)
+        if truncated is None:
+            old_vol_file = open(volumes_file, "r+")
+            lines  = old_vol_file.readlines()
+            old_vol_file.close()
+            truncated = (len(lines) - 1) > cutoff
+            if truncated:
+                lines = lines[:(cutoff+1)]
+                new_vol_file =  open(volumes_file,"w+")
+
+                for line in lines:
+                    new_vol_file.write(line)
+                new_vol_file.close()
+    for traj_file in ("traj.hdf5","culled.hdf5"):
+        if h5traj.truncate(traj_file,cutoff):
+            print(f"Dropped frames of {traj_file} written after the restart file")
+    #frames are written independently of the samples, so the indexed trajectories of every rank are always checked
+    for traj_file in outindex.shards("traj.extxyz"):
+        if outindex.truncate(traj_file,cutoff,outindex.scan_frames):
+            print(f"Dropped frames of {traj_file} written after the restart file")
+    traj_truncated = None
+    if os.path.exists("traj.extxyz"):
+        traj_truncated = outindex.truncate("traj.extxyz",cutoff,outindex.scan_frames)
+        if traj_truncated:
+            print("Dropped frames of traj.extxyz written after the restart file")
+    if truncated:
         print("Warning, restarting from an older file, data may be overwritten/deleted")
         sys.stdout.flush()
-        lines = lines[:(args["prev_iters"]+1)]
-        new_vol_file =  open("volumes.txt","w+")
-        
-        for line in lines:
-            new_vol_file.write(line)
-        sys.stdout.flush()
-        new_vol_file.close()
-        n_ase_images  = max(args["prev_iters"]//traj_interval,1)
-        old_images = ase.io.read("traj.extxyz",f":{n_ase_images}", parallel = False)
-        ase.io.write("traj.extxyz", old_images, parallel = False, append = False )
+        if not os.path.exists("traj.extxyz"):
+            return
+        if traj_truncated is None:
+            n_ase_images  = max(cutoff//traj_interval,1)
+            old_images = ase.io.read("traj.extxyz",f":{n_ase_images}", parallel = False)
+            ase.io.write("traj.extxyz", old_images, parallel = False, append = False )
         return
@@ -0,0 +1,112 @@
+import signal
+from timeit import default_timer as timer
+
+#Decides on rank 0 when the nested sampling loop should checkpoint or stop. Checkpoints are
+#spaced in wall time rather than iterations, so at most max_lost_time of work is lost if the job
+#is killed, while the time spent writing them stays a small fraction of the run. The run stops,
+#writing a final checkpoint, once the remaining time budget would not cover a few more
+#iterations and a checkpoint, or when the batch system sends SIGTERM. SIGUSR1 asks for a
+#checkpoint at the next iteration without stopping, and SIGUSR2 for a snapshot of every walker.
+
+CONTINUE = 0
+CHECKPOINT = 1
+STOP = 2
+
+
+class CheckpointScheduler:
+    """Measures the iteration rate and checkpoint cost, and picks when to checkpoint and stop.
+        Arguments:
+            t0: Start time of the run, as given by `timeit.default_timer`.
+            time_budget: Wall time allocated to the run in seconds, None if unlimited.
+            max_lost_time: Longest time in seconds allowed between checkpoints.
+            max_overhead: Largest fraction of the run spent writing checkpoints.
+            reserve: Time in seconds kept free at the end of the budget on top of the final checkpoint."""
+
+    def __init__(self, t0, time_budget=None, max_lost_time=3600.0, max_overhead=0.05, reserve=60.0):
+        self.t0 = t0
+        self.time_budget = time_budget
+        self.max_lost_time = max_lost_time
+        self.max_overhead = max_overhead
+        self.reserve = reserve
+        self.iteration_time = 0.0
+        self.checkpoint_cost = 0.0
+        self.last_checkpoint = timer()
+        self.last_iteration = None
+        self.checkpoint_t0 = None
+        self.requested = CONTINUE
+        self.snapshot_requested = False
+        self.previous_handlers = {}
+
+    def install_handlers(self):
+        """Catches SIGTERM, SIGUSR1 and SIGUSR2, which would otherwise kill the process before it can checkpoint.
+        Should be called on every rank, as a signal may reach any of them. Ranks other than the one calling `action`
+        pass on their requests with `request` and `snapshot`, to be combined over all ranks."""
+        for signum in (signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2):
+            try:
+                self.previous_handlers[signum] = signal.signal(signum, self._handler)
+            except ValueError: #not the main thread
+                pass
+
+    def restore_handlers(self):
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = {}
+
+    def _handler(self, signum, frame):
+        if signum == signal.SIGUSR2:
+            self.snapshot_requested = True
+            return
+        self.requested = max(self.requested, STOP if signum == signal.SIGTERM else CHECKPOINT)
+
+    def request(self):
+        """Returns:
+            The strongest of CHECKPOINT or STOP asked for by a signal since the last call, CONTINUE if none."""
+        requested, self.requested = self.requested, CONTINUE
+        return requested
+
+    def snapshot(self):
+        """Returns:
+            True if a snapshot was asked for with SIGUSR2 since the last call."""
+        requested, self.snapshot_requested = self.snapshot_requested, False
+        return requested
+
+    def interval(self):
+        """Returns:
+            Wall time in seconds between checkpoints."""
+        return max(self.max_lost_time, self.checkpoint_cost/self.max_overhead)
+
+    def remaining(self, now):
+        """Returns:
+            Wall time in seconds left in the budget, infinite if there is none."""
+        if self.time_budget is None:
+            return float("inf")
+        return self.time_budget - (now-self.t0)
+
+    def action(self):
+        """Called once per iteration on rank 0.
+        Returns:
+            What the loop should do at the end of this iteration, one of CONTINUE, CHECKPOINT or STOP."""
+        now = timer()
+        if self.last_iteration is not None:
+            if self.iteration_time == 0.0:
+                self.iteration_time = now-self.last_iteration
+            #running average over roughly the last hundred iterations
+            self.iteration_time += 0.01*((now-self.last_iteration)-self.iteration_time)
+        self.last_iteration = now
+
+        requested = self.request()
+        if requested == STOP or self.remaining(now) < self.reserve + 2*self.checkpoint_cost + 10*self.iteration_time:
+            return STOP
+        if requested == CHECKPOINT or now-self.last_checkpoint >= self.interval():
+            return CHECKPOINT
+        return CONTINUE
+
+    def checkpoint_started(self):
+        self.checkpoint_t0 = timer()
+
+    def checkpoint_done(self):
+        """Records the cost of a full checkpoint started with `checkpoint_started`. When the checkpoint is written in
+        the background, this should be submitted to the writer after it, so the cost includes the write itself."""
+        now = timer()
+        self.checkpoint_cost = now-self.checkpoint_t0
+        self.last_checkpoint = now
@@ -0,0 +1,121 @@
+import argparse
+import glob
+import os
+import h5py
+import numpy as np
+
+#Lossy codec for configurations kept for analysis rather than for restarting, such as trajectory frames
+#and the archive of culled walkers. Positions are converted to fractional coordinates and rounded to a
+#grid of 2**bits points along each cell vector. Each chain stores the grid point of its first bead,
+#wrapped into the cell, followed by the integer steps between consecutive beads along the backbone. The
+#steps are small integers, which the HDF5 shuffle and gzip filters compress well, and since the rounding
+#is done on absolute positions before differencing the error does not accumulate along a chain. Every bead
+#is within `error_bound` of its true position, up to a lattice translation of its whole chain.
+
+
+def check_bits(bits):
+    """Raises ValueError unless bits is a usable number of bits per fractional coordinate. Grid points are
+    stored as int32, so at most 30 bits leave room for the sign and for the steps between beads."""
+    if not 1 <= bits <= 30:
+        raise ValueError(f"bits per fractional coordinate must be between 1 and 30, got {bits}")
+
+
+def encode(cell, coords, bits=16):
+    """Quantises a configuration.
+    Arguments:
+        cell: Cell vectors as rows of a (3,3) array.
+        coords: (nchains, nbeads, 3) Cartesian coordinates, chains need not be wrapped into the cell.
+        bits: Number of bits per fractional coordinate.
+    Returns:
+        q: (nchains, nbeads, 3) int32 array, the grid point of each first bead then the steps along each chain."""
+    check_bits(bits)
+    scale = 2**bits
+    grid = np.rint(np.asarray(coords) @ np.linalg.inv(cell) * scale).astype(np.int64)
+    grid -= (grid[:,:1] // scale) * scale #translates each chain so its first bead is in the cell
+    q = np.empty(grid.shape, dtype=np.int32)
+    q[:,0] = grid[:,0]
+    q[:,1:] = np.diff(grid, axis=1)
+    return q
+
+
+def decode(cell, q, bits=16):
+    """Returns:
+        coords: (nchains, nbeads, 3) Cartesian coordinates of a configuration quantised by `encode`."""
+    grid = np.cumsum(np.asarray(q, dtype=np.int64), axis=1)
+    return (grid / 2**bits) @ np.asarray(cell)
+
+
+def error_bound(cell, bits=16):
+    """Returns:
+        Largest distance between a bead and its decoded position, in the units of the cell, i.e. bead diameters."""
+    return 0.5 / 2**bits * np.linalg.norm(cell, axis=1).sum()
+
+
+def _pair_distances(cell, a, b):
+    """Returns:
+        Minimum image distances between the beads a and b, checking the 27 nearest images."""
+    shifts = np.array([[i,j,k] for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1)]) @ cell
+    frac = (a[:,None,:] - b[None,:,:]) @ np.linalg.inv(cell)
+    d = (frac - np.rint(frac)) @ cell
+    return np.sqrt(((d[:,:,None,:] + shifts)**2).sum(axis=-1).min(axis=-1))
+
+
+def new_overlaps(cell, coords, decoded, sigma=1.0, block=256):
+    """Counts the pairs of beads at least sigma apart in a configuration which are closer than sigma once
+    it has been decoded. Pairs already closer than sigma, such as bonded beads, are not counted.
+    Returns:
+        Number of overlaps introduced by the codec."""
+    a = np.asarray(coords).reshape(-1,3)
+    b = np.asarray(decoded).reshape(-1,3)
+    n = 0
+    for start in range(0, len(a), block):
+        before = _pair_distances(cell, a[start:start+block], a)
+        after = _pair_distances(cell, b[start:start+block], b)
+        n += np.count_nonzero((before >= sigma) & (after < sigma))
+    return n//2
+
+
+def check_roundtrip(cell, coords, bits=16, sigma=1.0):
+    """Encodes and decodes a configuration.
+    Returns:
+        error: Largest distance between a bead and its decoded position, up to a lattice translation of its chain.
+        bound: Guaranteed bound on the error, from `error_bound`.
+        overlaps: Number of overlaps introduced, from `new_overlaps`."""
+    decoded = decode(cell, encode(cell, coords, bits), bits)
+    frac = (decoded - coords) @ np.linalg.inv(cell)
+    error = np.linalg.norm((frac - np.rint(frac)) @ cell, axis=-1).max()
+    return error, error_bound(cell, bits), new_overlaps(cell, coords, decoded, sigma)
+
+
+def check_restart(filename, bits=16, sigma=1.0):
+    """Runs `check_roundtrip` on every walker saved in a sharded restart file, printing the worst case per shard.
+    Returns:
+        True if no walker had an overlap introduced or an error above the bound."""
+    with h5py.File(filename, "r") as f:
+        nbeads, nchains = int(f.attrs["nbeads"]), int(f.attrs["nchains"])
+    root, ext = os.path.splitext(filename)
+    ok = True
+    for shard in sorted(glob.glob(f"{root}.rank*{ext}")):
+        with h5py.File(shard, "r") as f:
+            cells, coords = f["unitcell"][:], f["coordinates"][:]
+        worst = (0.0, 0.0, 0)
+        for cell, walker in zip(cells, coords):
+            error, bound, overlaps = check_roundtrip(cell, walker.reshape(nchains,nbeads,3), bits, sigma)
+            ok = ok and error <= bound and overlaps == 0
+            worst = (max(worst[0],error), max(worst[1],bound), worst[2]+overlaps)
+        print(f"{shard}: largest error {worst[0]:.3e}, bound {worst[1]:.3e}, overlaps introduced {worst[2]}")
+    return ok
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Check the quantised coordinate codec against the walkers of a restart file")
+    p.add_argument("file", nargs="?", default="restart.hdf5", help="sharded restart file")
+    p.add_argument("-b", "--bits", type=int, default=16, help="bits per fractional coordinate")
+    p.add_argument("--sigma", type=float, default=1.0, help="bead diameter")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    if not check_restart(args.file, args.bits, args.sigma):
+        raise SystemExit(1)
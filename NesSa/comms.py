@@ -0,0 +1,185 @@
+import argparse
+import numpy as np
+from NesSa import MCNS as NS
+
+#Buffer based communication for the nested sampling loop. Everything sent each iteration is a
+#contiguous numpy array, so mpi4py passes it straight to MPI without pickling, and a walker is
+#only sent to the rank which needs it. mpi4py is imported only where MPI is actually needed, so
+#runs on a single process with `serial.SerialComm` do not require it.
+
+maxloc_dtype = np.dtype([("vol","f8"),("index","i4")], align=True) #matches MPI.DOUBLE_INT
+
+
+def global_max(comm, local_max, local_index, nboxes):
+    """Finds the largest walker volume over all ranks.
+    Arguments:
+        comm: Communicator of the run.
+        local_max: Largest volume on this rank.
+        local_index: Index of the walker with that volume on this rank.
+        nboxes: Number of walkers (simulation boxes) per rank.
+    Returns:
+        vol_max: Largest volume over all ranks.
+        vol_max_index: [rank, index] of the walker with that volume."""
+    if comm.Get_size() == 1:
+        return float(local_max), [0, int(local_index)]
+    from mpi4py import MPI
+    sendbuf = np.empty(1, dtype=maxloc_dtype)
+    recvbuf = np.empty(1, dtype=maxloc_dtype)
+    sendbuf["vol"] = local_max
+    sendbuf["index"] = comm.Get_rank()*nboxes + local_index
+    comm.Allreduce([sendbuf, MPI.DOUBLE_INT], [recvbuf, MPI.DOUBLE_INT], op=MPI.MAXLOC)
+    return float(recvbuf["vol"][0]), list(divmod(int(recvbuf["index"][0]), nboxes))
+
+
+def broadcast_ints(comm, values, n=2, root=0):
+    """Broadcasts a short tuple of integers from root.
+    Arguments:
+        values: Tuple of n integers on root, ignored elsewhere.
+        n: Number of integers.
+    Returns:
+        Tuple of the integers on every rank."""
+    buf = np.empty(n, dtype=np.int64)
+    if comm.Get_rank() == root:
+        buf[:] = values
+    comm.Bcast(buf, root=root)
+    return tuple(int(v) for v in buf)
+
+
+def max_ints(comm, values, n=2):
+    """Takes the largest of each of a short tuple of integers over all ranks.
+    Arguments:
+        values: Tuple of n integers on every rank.
+    Returns:
+        Tuple of the largest values, the same on every rank."""
+    if comm.Get_size() == 1:
+        return tuple(int(v) for v in values)
+    from mpi4py import MPI
+    sendbuf = np.asarray(values, dtype=np.int64)
+    recvbuf = np.empty(n, dtype=np.int64)
+    comm.Allreduce(sendbuf, recvbuf, op=MPI.MAX)
+    return tuple(int(v) for v in recvbuf)
+
+
+def transfer_arrays(comm, src_rank, dst_rank, cell, coords, tag=7):
+    """Sends a walker's cell and coordinates from one rank to another as a single contiguous buffer.
+    Arguments:
+        src_rank, dst_rank: Ranks sending and receiving the walker.
+        cell: (3,3) array on src_rank.
+        coords: Array of bead positions on src_rank, e.g. (nchains,nbeads,3), on dst_rank only its shape is used.
+    Returns:
+        cell, coords: The received arrays on dst_rank, the arguments unchanged elsewhere."""
+    rank = comm.Get_rank()
+    if src_rank == dst_rank:
+        return cell, coords
+    from mpi4py import MPI
+    if rank == src_rank:
+        buf = np.empty(9+coords.size)
+        buf[:9] = cell.ravel()
+        buf[9:] = coords.ravel()
+        comm.Send([buf, MPI.DOUBLE], dest=dst_rank, tag=tag)
+    elif rank == dst_rank:
+        buf = np.empty(9+coords.size)
+        comm.Recv([buf, MPI.DOUBLE], source=src_rank, tag=tag)
+        cell = buf[:9].reshape(3,3)
+        coords = buf[9:].reshape(coords.shape)
+    return cell, coords
+
+
+def clone_walker(comm, src_rank, src_box, dst_rank, dst_box, nbeads, nchains, store=None):
+    """Copies a walker into another simulation box, which may be on another rank. Ranks other than
+    the two involved return straight away, and a clone within a rank is a local copy.
+    Arguments:
+        src_rank: Rank holding the walker to copy.
+        src_box: Simulation box of the walker to copy.
+        dst_rank: Rank holding the box to overwrite.
+        dst_box: Simulation box to overwrite.
+        nbeads: Number of beads per chain.
+        nchains: Number of chains.
+        store: Optional `SharedWalkerStore`, used to copy walkers between ranks of the same node."""
+    rank = comm.Get_rank()
+    if rank != src_rank and rank != dst_rank:
+        return
+    if src_rank == dst_rank:
+        NS.clone_walker(int(src_box), int(dst_box))
+        return
+    if store is not None and store.on_node(src_rank) and store.on_node(dst_rank):
+        #the source waits for the destination to have copied the walker before returning, since it may
+        #walk the same walker straight away and publish it over the row being read
+        from mpi4py import MPI
+        ack = np.empty(0, dtype=np.int8)
+        if rank == dst_rank:
+            NS.set_walker_state(dst_box, store.read(src_rank, src_box))
+            comm.Send([ack, MPI.BYTE], dest=src_rank, tag=8)
+        else:
+            comm.Recv([ack, MPI.BYTE], source=dst_rank, tag=8)
+        return
+    if rank == src_rank:
+        state = NS.get_walker_state(src_box, nbeads, nchains)
+        transfer_arrays(comm, src_rank, dst_rank, state.cell, state.coords)
+    else:
+        cell, coords = transfer_arrays(comm, src_rank, dst_rank, None, np.empty((nchains,nbeads,3)))
+        NS.set_walker_state(dst_box, NS.WalkerState(cell, coords))
+
+
+def benchmark(comm, natoms, nboxes=100, niter=2000):
+    """Times the communication of one nested sampling iteration, comparing the pickle based collectives
+    previously used in `mpihans` with the buffer based ones above. Uses random arrays in place of
+    walkers, so hs_alkane is not needed.
+    Returns:
+        t_pickle, t_buffer: Mean time per iteration in seconds, the slowest rank's time on every rank."""
+    from mpi4py import MPI
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    rng = np.random.default_rng(rank)
+    cell = np.eye(3)
+    coords = rng.random((natoms,3))
+
+    times = []
+    for buffered in (False, True):
+        comm.Barrier()
+        t0 = MPI.Wtime()
+        for i in range(niter):
+            local_max = rng.random()
+            local_index = int(rng.integers(nboxes))
+            clone = None
+            if rank == 0:
+                clone = (int(rng.integers(size)), int(rng.integers(nboxes)))
+            if buffered:
+                vol_max, vol_max_index = global_max(comm, local_max, local_index, nboxes)
+                clone = broadcast_ints(comm, clone)
+                transfer_arrays(comm, clone[0], vol_max_index[0], cell, coords)
+            else:
+                vol_max, vol_max_index = comm.allreduce([local_max,[rank,local_index]], op=MPI.MAXLOC)
+                clone = comm.bcast(clone, root=0)
+                config = (cell, coords) if rank == clone[0] else None
+                config = comm.bcast(config, root=clone[0])
+        times.append(comm.allreduce((MPI.Wtime()-t0)/niter, op=MPI.MAX))
+    return times[0], times[1]
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Time the per-iteration communication of the NS loop against the number of ranks")
+    p.add_argument("--nchains", type=int, default=32, help="number of chains per walker")
+    p.add_argument("--nbeads", type=int, default=6, help="number of beads per chain")
+    p.add_argument("--niter", type=int, default=2000, help="number of iterations to time")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    from mpi4py import MPI
+    args = parse_cli()
+    world = MPI.COMM_WORLD
+    if world.Get_rank() == 0:
+        print(f"{'ranks':>6} {'pickle (us/iter)':>18} {'buffer (us/iter)':>18}")
+    nranks = 1
+    while True:
+        sub = world.Split(0 if world.Get_rank() < nranks else MPI.UNDEFINED, world.Get_rank())
+        if sub != MPI.COMM_NULL:
+            t_pickle, t_buffer = benchmark(sub, args.nchains*args.nbeads, niter=args.niter)
+            if sub.Get_rank() == 0:
+                print(f"{nranks:>6} {t_pickle*1e6:>18.2f} {t_buffer*1e6:>18.2f}")
+            sub.Free()
+        world.Barrier()
+        if nranks == world.Get_size():
+            break
+        nranks = min(2*nranks, world.Get_size())
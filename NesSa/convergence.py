@@ -0,0 +1,92 @@
+import math
+import numpy as np
+from NesSa import ns_analyse
+
+#Running estimate of the partition function at a fixed betaP, used to stop a run once
+#the prior volume that is left can no longer change the thermodynamics at that betaP.
+
+
+class EvidenceTracker:
+    """Tracks the log prior volume and log partition function of a run as samples are produced,
+    using the same recurrence as `ns_analyse.calc_log_a`.
+        Arguments:
+            n_walkers: Total number of walkers across all ranks.
+            betaP: The largest value of beta*P (1/T in ns_analyse with kB = 1) of interest.
+            n_cull: Number of walkers culled per iteration."""
+
+    def __init__(self, n_walkers, betaP, n_cull=1):
+        self.n_walkers = n_walkers
+        self.n_cull = n_cull
+        self.betaP = betaP
+        self.n_samples = 0
+        self.log_X = 0.0
+        self.log_Z = -np.inf
+        #with a varying number of live walkers, a_n = X_n/(K_(n+1)+1) needs the count of the next sample, so the
+        #latest sample's term is held back until it arrives and otherwise uses its own count, as in calc_log_a_variable
+        self.pending = None
+
+    def add_sample(self, vol, n_walkers=None):
+        """Adds the volume of the culled walker of the next iteration.
+        Arguments:
+            vol: Volume of the culled walker.
+            n_walkers: Number of live walkers when it was culled, if it varies during the run, in which case
+                       n_cull must be 1."""
+        if n_walkers is None:
+            N = self.n_walkers
+            P = self.n_cull
+            i = self.n_samples
+            self.log_X += math.log(N-i%P) - math.log(N+1-i%P)
+            log_a = self.log_X - math.log(N+1-(i+1)%P)
+            self.log_Z = np.logaddexp(self.log_Z, log_a - self.betaP*vol)
+        else:
+            if self.pending is not None:
+                log_X, pending_vol, _ = self.pending
+                self.log_Z = np.logaddexp(self.log_Z, log_X - math.log(n_walkers+1) - self.betaP*pending_vol)
+            self.log_X += math.log(n_walkers) - math.log(n_walkers+1)
+            self.pending = (self.log_X, vol, n_walkers)
+        self.n_samples += 1
+
+    def total_log_Z(self):
+        """Returns:
+            log of the partition function at betaP summed over every sample so far."""
+        if self.pending is None:
+            return self.log_Z
+        log_X, vol, n_walkers = self.pending
+        return np.logaddexp(self.log_Z, log_X - math.log(n_walkers+1) - self.betaP*vol)
+
+    def replay(self, filename="volumes.txt"):
+        """Rebuilds the running sums from an existing volumes file, e.g. when restarting.
+        Arguments:
+            filename: Volumes file in the pymatnest format written by `mpihans`."""
+        (n_walkers, n_cull, _, _, _, Es, _, Ks) = ns_analyse.read_inputs(filename)
+        if len(Es) == 0:
+            return
+        self.n_walkers = n_walkers
+        self.n_cull = n_cull
+        if Ks is None:
+            i_range = np.arange(len(Es))
+            log_X_n = np.cumsum(np.log(n_walkers-i_range%n_cull) - np.log(n_walkers+1-i_range%n_cull))
+        else:
+            log_X_n = np.cumsum(np.log(Ks) - np.log(Ks+1.0))
+        log_a = ns_analyse.calc_log_a(len(Es), n_walkers, n_cull, Ks=Ks)
+        log_Z_terms = log_a - self.betaP*Es
+        self.pending = None
+        if Ks is not None:
+            #the last term waits for the count of the next sample, as in add_sample
+            self.pending = (log_X_n[-1], Es[-1], Ks[-1])
+            log_Z_terms = log_Z_terms[:-1]
+        self.log_Z = -np.inf
+        if len(log_Z_terms):
+            shift = np.amax(log_Z_terms)
+            self.log_Z = shift + math.log(np.sum(np.exp(log_Z_terms-shift)))
+        self.log_X = log_X_n[-1]
+        self.n_samples = len(Es)
+
+    def remaining_fraction(self, vol_min):
+        """Estimated fraction of the partition function at betaP still contained in the live walkers.
+        Arguments:
+            vol_min: Smallest volume among the live walkers on all ranks.
+        Returns:
+            Estimate of Z_remaining/(Z_sampled+Z_remaining)."""
+        log_Z_rem = self.log_X - self.betaP*vol_min
+        return math.exp(log_Z_rem - np.logaddexp(self.total_log_Z(), log_Z_rem))
@@ -0,0 +1,99 @@
+import argparse
+import numpy as np
+from NesSa import ns_analyse
+
+#Schedules for dynamic nested sampling, where the number of live walkers is raised in the
+#volume ranges where the thermodynamics needs more resolution (e.g. around phase transitions)
+#and lowered elsewhere.
+
+
+class WalkerSchedule:
+    """Number of live walkers per rank to use as a function of the current culled volume.
+        Arguments:
+            ranges: Array of rows (vol_low, vol_high, nwalkers). While the culled volume lies in
+                    [vol_low, vol_high) the largest matching nwalkers is used.
+            default: Number of live walkers per rank outside of every range."""
+
+    def __init__(self, ranges, default):
+        self.ranges = np.array(ranges, dtype=np.float64).reshape(-1, 3)
+        self.default = int(default)
+
+    def target(self, vol):
+        """Returns:
+            Number of live walkers per rank to use when the culled volume is `vol`."""
+        inside = (self.ranges[:, 0] <= vol) & (vol < self.ranges[:, 1])
+        if not np.any(inside):
+            return self.default
+        return int(self.ranges[inside, 2].max())
+
+    def max_walkers(self):
+        """Returns:
+            Largest number of live walkers per rank the schedule can ask for."""
+        if len(self.ranges) == 0:
+            return self.default
+        return max(self.default, int(self.ranges[:, 2].max()))
+
+
+def read_walker_schedule(filename):
+    """Reads a walker schedule file containing one `vol_low vol_high nwalkers` row per line.
+    Lines starting with # are ignored.
+    Arguments:
+        filename: Schedule file to read.
+    Returns:
+        ranges: Array of shape (nranges, 3)."""
+    ranges = np.loadtxt(filename, comments="#", ndmin=2)
+    if ranges.size and ranges.shape[1] != 3:
+        raise ValueError(f"Walker schedule {filename} should have 3 columns: vol_low vol_high nwalkers")
+    return ranges.reshape(-1, 3)
+
+
+def schedule_from_pilot(filename, betaP_min, betaP_max, nwalkers_peak, n_betaP=500, peak_fraction=0.2, z_fraction=0.1):
+    """Builds a walker schedule from a pilot run by locating the peaks of the constant pressure heat
+    capacity (equivalently, of the volume fluctuations) over a range of betaP.
+    Arguments:
+        filename: volumes.txt of the pilot run.
+        betaP_min, betaP_max: Range of betaP (1/T in ns_analyse with kB = 1) to search for peaks.
+        nwalkers_peak: Number of live walkers per rank to use around the peaks.
+        n_betaP: Number of betaP values to evaluate.
+        peak_fraction: Only local maxima larger than this fraction of the largest peak are used.
+        z_fraction: The volume range of a peak covers the samples whose weight is above this fraction
+                    of the largest weight at the peak's betaP.
+    Returns:
+        ranges: Array of (vol_low, vol_high, nwalkers_peak) rows, one per peak."""
+    (n_walkers, n_cull, _, _, _, Es, _, Ks) = ns_analyse.read_inputs(filename)
+    log_a = ns_analyse.calc_log_a(len(Es), n_walkers, n_cull, Ks=Ks)
+
+    betaPs = np.linspace(betaP_min, betaP_max, n_betaP)
+    Cp = np.empty(n_betaP)
+    weights = []
+    for j, betaP in enumerate(betaPs):
+        Z_term, _ = ns_analyse.calc_Z_terms(betaP, log_a, Es)
+        Z = np.sum(Z_term)
+        V = np.sum(Z_term*Es)/Z
+        Cp[j] = betaP**2*(np.sum(Z_term*Es**2)/Z - V**2)
+        weights.append(Z_term)
+
+    ranges = []
+    for j in range(1, n_betaP-1):
+        if Cp[j] > Cp[j-1] and Cp[j] >= Cp[j+1] and Cp[j] > peak_fraction*Cp.max():
+            important = np.flatnonzero(weights[j] > z_fraction*weights[j].max())
+            #samples are in order of decreasing volume
+            ranges.append((Es[important[-1]], Es[important[0]], nwalkers_peak))
+    return np.array(ranges, dtype=np.float64).reshape(-1, 3)
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Build a dynamic walker schedule from a pilot run")
+    p.add_argument("file", help="volumes.txt of the pilot run")
+    p.add_argument("--betaP_min", type=float, required=True, help="smallest betaP to search for heat capacity peaks")
+    p.add_argument("--betaP_max", type=float, required=True, help="largest betaP to search for heat capacity peaks")
+    p.add_argument("--nwalkers_peak", type=int, required=True, help="live walkers per rank around the peaks")
+    p.add_argument("-o", "--output", default="walker_schedule.txt", help="schedule file to write")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    ranges = schedule_from_pilot(args.file, args.betaP_min, args.betaP_max, args.nwalkers_peak)
+    np.savetxt(args.output, ranges, fmt=["%.13f", "%.13f", "%d"], header="vol_low vol_high nwalkers")
+    print(f"Wrote {len(ranges)} range(s) to {args.output}")
@@ -0,0 +1,109 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from NesSa import MCNS as NS
+
+#Runs the Monte Carlo walks of several walkers at the same time from a single rank. hs_alkane
+#keeps its state in Fortran module variables, so each worker is a separate process with its own
+#hs_alkane instance holding a single box. Walkers are passed to and from the workers through a
+#block of shared memory, one slot per worker, and only step sizes and results go through pipes.
+
+
+def _worker(conn, shm_name, slot, args):
+    """Main loop of a worker process, walking whichever walker is placed in its slot."""
+    worker_args = dict(args)
+    worker_args["nwalkers"] = 1
+    worker_args["nboxes"] = 1
+    NS.initialise_sim_cells(worker_args, quiet = 1)
+    nbeads = args["nbeads"]
+    nchains = args["nchains"]
+    shm = shared_memory.SharedMemory(name = shm_name)
+    state = np.ndarray((9+3*nbeads*nchains,), dtype = np.float64, buffer = shm.buf, offset = slot*(9+3*nbeads*nchains)*8)
+    walker = NS.WalkerState(state[:9].reshape(3,3), state[9:].reshape(nchains,nbeads,3))
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        sweeps, move_ratio, volume_limit, steps, dshear, dstretch, seed = task
+        #seeded for every walk from the parent's stream, so walks do not depend on which worker runs them
+        NS.alk.random_set_random_seed(int(seed))
+        np.random.seed(seed)
+        NS.alk.alkane_set_dv_max(steps[0])
+        NS.alk.alkane_set_dr_max(steps[1])
+        NS.alk.alkane_set_dt_max(steps[2])
+        NS.alk.alkane_set_dh_max(steps[3])
+        NS.set_walker_state(1, walker)
+        vol, rate = NS.MC_run(worker_args, sweeps, move_ratio, 1, volume_limit = volume_limit,
+                              min_ar = args["min_aspect_ratio"], min_ang = args["min_angle"],
+                              dshear = dshear, dstretch = dstretch)
+        NS.get_walker_state(1, nbeads, nchains, out = walker)
+        conn.send((vol, rate))
+    del walker, state
+    shm.close()
+    NS.alk.alkane_destroy()
+    NS.alk.box_destroy()
+
+
+class WalkExecutor:
+    """Pool of worker processes, each walking one walker at a time alongside the calling process.
+        Arguments:
+            args: Dictionary of simulation parameters.
+            nworkers: Number of worker processes."""
+
+    def __init__(self, args, nworkers):
+        self.args = args
+        self.nworkers = nworkers
+        self.nbeads = args["nbeads"]
+        self.nchains = args["nchains"]
+        self.record = 9 + 3*self.nbeads*self.nchains
+        self.shm = shared_memory.SharedMemory(create = True, size = nworkers*self.record*8)
+        self.states = np.ndarray((nworkers, self.record), dtype = np.float64, buffer = self.shm.buf)
+        self.walkers = [NS.WalkerState(state[:9].reshape(3,3), state[9:].reshape(self.nchains,self.nbeads,3)) for state in self.states]
+
+        #spawn rather than fork, so workers do not inherit MPI or hs_alkane state
+        ctx = mp.get_context("spawn")
+        worker_args = {key: args[key] for key in ["nbeads","nchains","bondlength","bondangle","min_aspect_ratio","min_angle"]}
+        self.conns = []
+        self.procs = []
+        for slot in range(nworkers):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target = _worker, args = (child_conn, self.shm.name, slot, worker_args), daemon = True)
+            proc.start()
+            self.conns.append(parent_conn)
+            self.procs.append(proc)
+
+    def walk(self, boxes, sweeps, move_ratio, volume_limit, dshear = 1.0, dstretch = 1.0):
+        """Walks several simulation boxes concurrently, with the current step sizes of this process.
+        Arguments:
+            boxes: Simulation boxes to walk, starting from 1.
+            sweeps: Number of sweeps for each walk.
+            move_ratio: Ratio of move types, as for `MC_run`.
+            volume_limit: Largest volume allowed.
+            dshear, dstretch: Step sizes of the shear and stretch moves.
+        Returns:
+            results: List of (volume, acceptance rates) for each box, in the order given."""
+        steps = (NS.alk.alkane_get_dv_max(), NS.alk.alkane_get_dr_max(), NS.alk.alkane_get_dt_max(), NS.alk.alkane_get_dh_max())
+        results = []
+        #the first box of each batch is walked by this process while the workers walk the rest
+        for start in range(0, len(boxes), self.nworkers+1):
+            local_box = boxes[start]
+            batch = boxes[start+1:start+self.nworkers+1]
+            for slot, ibox in enumerate(batch):
+                NS.get_walker_state(ibox, self.nbeads, self.nchains, out = self.walkers[slot])
+                self.conns[slot].send((sweeps, move_ratio, volume_limit, steps, dshear, dstretch, np.random.randint(1, 2**31-1)))
+            results.append(NS.MC_run(self.args, sweeps, move_ratio, local_box, volume_limit = volume_limit,
+                                     min_ar = self.args["min_aspect_ratio"], min_ang = self.args["min_angle"],
+                                     dshear = dshear, dstretch = dstretch))
+            for slot, ibox in enumerate(batch):
+                results.append(self.conns[slot].recv())
+                NS.set_walker_state(ibox, self.walkers[slot])
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for proc in self.procs:
+            proc.join()
+        del self.walkers, self.states
+        self.shm.close()
+        self.shm.unlink()
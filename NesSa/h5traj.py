@@ -0,0 +1,174 @@
+import argparse
+import glob
+import heapq
+import os
+import h5py
+import numpy as np
+from NesSa import codec
+
+#HDF5 alternative to traj.extxyz. Every rank keeps one file open for the whole run, e.g. traj.rank3.hdf5,
+#and appends the frames it holds the largest walker for to chunked, compressed datasets: the iteration,
+#volume, cell and the (nchains, nbeads, 3) coordinates of each frame. Frames are buffered and written in
+#blocks rather than reopening a text file for each one, which makes it affordable to record frames far
+#more often. Coordinates are stored as hs_alkane holds them, without wrapping chains back into the cell.
+#`export_extxyz` merges the files of a run by iteration into an extxyz trajectory. With bits set the
+#coordinates are stored quantised by `codec`, along with the error bound of each frame.
+
+
+def shards(filename):
+    """Returns:
+        Sorted names of the per rank files of the trajectory filename, named as by `NSio.shard_filename`."""
+    root, ext = os.path.splitext(filename)
+    return sorted(glob.glob(f"{root}.rank*{ext}"))
+
+
+class TrajectoryWriter:
+    """Appends frames to one rank's HDF5 trajectory, keeping the file open between writes.
+        Arguments:
+            filename: Trajectory to create, or to append to if it already exists.
+            nbeads, nchains: Shape of the configurations.
+            block: Number of frames buffered before they are written.
+            compression: HDF5 filter used for the datasets, None for no compression.
+            bits: Bits per fractional coordinate when coordinates are stored quantised by `codec`, None to store them exactly.
+                  Ignored when appending, the file keeps the precision it was created with.
+            writer: Optional `AsyncWriter` performing the writes in the background."""
+
+    def __init__(self, filename, nbeads, nchains, block=64, compression="gzip", bits=None, writer=None):
+        if bits is not None:
+            codec.check_bits(bits)
+        self.writer = writer
+        self.file = h5py.File(filename, "a")
+        if "coordinates" in self.file:
+            bits = self.file["coordinates"].attrs.get("bits")
+        self.bits = None if bits is None else int(bits)
+        frame_bytes = nchains*nbeads*3*8
+        chunk = max(1, min(block, 2**20//frame_bytes)) #chunks of at most a megabyte of coordinates
+        datasets = [("iter",(),"i8"), ("volume",(),"f8"), ("cell",(3,3),"f8"),
+                    ("coordinates",(nchains,nbeads,3),"f8" if self.bits is None else "i4")]
+        if self.bits is not None:
+            datasets.append(("error_bound",(),"f8"))
+        for name, shape, dtype in datasets:
+            if name not in self.file:
+                self.file.create_dataset(name, shape=(0,)+shape, maxshape=(None,)+shape, dtype=dtype,
+                                         chunks=(chunk,)+shape, compression=compression, shuffle=compression is not None)
+        if self.bits is not None:
+            self.file["coordinates"].attrs["bits"] = self.bits
+        self.buffer = {name: np.zeros((block,)+shape, dtype=dtype) for name, shape, dtype in datasets}
+        self.n = 0
+
+    def append(self, i, volume, cell, coordinates):
+        """Adds the configuration with the given cell and (nchains, nbeads, 3) coordinates, written at iteration i."""
+        self.buffer["iter"][self.n] = i
+        self.buffer["volume"][self.n] = volume
+        self.buffer["cell"][self.n] = cell
+        if self.bits is None:
+            self.buffer["coordinates"][self.n] = coordinates
+        else:
+            self.buffer["coordinates"][self.n] = codec.encode(cell, coordinates, self.bits)
+            self.buffer["error_bound"][self.n] = codec.error_bound(cell, self.bits)
+        self.n += 1
+        if self.n == len(self.buffer["iter"]):
+            self.flush()
+
+    def flush(self):
+        """Writes out the buffered frames."""
+        data = {name: values[:self.n].copy() for name, values in self.buffer.items()}
+        self.n = 0
+        if self.writer is not None:
+            self.writer.submit(self._write, data)
+        else:
+            self._write(data)
+
+    def _write(self, data):
+        n = len(data["iter"])
+        if n == 0:
+            return
+        start = self.file["iter"].shape[0]
+        for name, values in data.items():
+            dset = self.file[name]
+            dset.resize(start+n, axis=0)
+            dset[start:] = values
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.submit(self.file.close)
+        else:
+            self.file.close()
+
+
+def truncate(filename, cutoff):
+    """Drops the frames of every rank's file from iteration cutoff onwards, e.g. those written after the
+    checkpoint a run is restarted from.
+    Returns:
+        True if any frames were dropped."""
+    truncated = False
+    for shard in shards(filename):
+        with h5py.File(shard, "r+") as f:
+            iters = f["iter"][:]
+            keep = np.searchsorted(iters, cutoff)
+            if keep < len(iters):
+                for name in ("iter","volume","cell","coordinates","error_bound"):
+                    if name in f:
+                        f[name].resize(keep, axis=0)
+                truncated = True
+    return truncated
+
+
+def iter_frames(filename, block=256):
+    """Reads one rank's trajectory in blocks.
+    Yields:
+        (i, volume, cell, coordinates) of each frame, in the order they were written, decoding quantised coordinates."""
+    with h5py.File(filename, "r") as f:
+        n = f["iter"].shape[0]
+        bits = f["coordinates"].attrs.get("bits")
+        for start in range(0, n, block):
+            stop = min(start+block, n)
+            iters, volumes = f["iter"][start:stop], f["volume"][start:stop]
+            cells, coords = f["cell"][start:stop], f["coordinates"][start:stop]
+            for k in range(stop-start):
+                if bits is None:
+                    yield int(iters[k]), float(volumes[k]), cells[k], coords[k]
+                else:
+                    yield int(iters[k]), float(volumes[k]), cells[k], codec.decode(cells[k], coords[k], int(bits))
+
+
+def read_frames(filename):
+    """Yields:
+        (i, volume, cell, coordinates) of every frame of a run's trajectory, merged across ranks by iteration."""
+    return heapq.merge(*(iter_frames(shard) for shard in shards(filename)), key=lambda frame: frame[0])
+
+
+def export_extxyz(filename, output, scaling=1.0, wrap=True):
+    """Writes a run's HDF5 trajectory as extxyz, as `NSio.write_to_extxyz` would have written it.
+    Arguments:
+        filename: Trajectory of the run, e.g. traj.hdf5 for the files traj.rank<N>.hdf5.
+        output: extxyz file to write.
+        scaling: Factor applied to the cell and coordinates, as in `MCNS.mk_ase_config`.
+        wrap: Whether to wrap beads back into the cell."""
+    import ase
+    import ase.io
+    with open(output, "w") as out:
+        for i, volume, cell, coords in read_frames(filename):
+            config = ase.Atoms("C"+str(coords.shape[0]*coords.shape[1]), positions=coords.reshape(-1,3)*scaling,
+                               pbc=True, cell=cell*scaling)
+            if wrap:
+                config.wrap()
+            config.info["iter"] = i
+            config.info["volume"] = volume
+            ase.io.write(out, config, format="extxyz", parallel=False)
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Convert an HDF5 trajectory written by mpihans to extxyz")
+    p.add_argument("file", nargs="?", default="traj.hdf5", help="trajectory to convert, e.g. traj.hdf5 for traj.rank<N>.hdf5")
+    p.add_argument("-o", "--output", default="traj.extxyz", help="extxyz file to write")
+    p.add_argument("--scaling", type=float, default=1.0, help="factor applied to the cell and coordinates")
+    p.add_argument("--no-wrap", action="store_true", help="keep beads outside the cell where hs_alkane put them")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    export_extxyz(args.file, args.output, scaling=args.scaling, wrap=not args.no_wrap)
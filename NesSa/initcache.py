@@ -0,0 +1,138 @@
+import argparse
+import os
+import time
+import h5py
+import numpy as np
+from NesSa import MCNS as NS
+from NesSa import NSio
+
+#On-disk cache of initial walkers drawn from the prior. Walkers depend only on the chain model
+#and cell shape constraints, so one cache can feed every run and parameter scan sharing them.
+#Every cached walker is handed out once, keeping separate runs independent of each other.
+
+
+def cache_filename(args, cache_dir):
+    """Returns:
+        Path of the cache file for the chain model and cell shape constraints in args."""
+    name = (f"initial_{args['nchains']}_{args['nbeads']}mer_b{float(args['bondlength']):g}_a{float(args['bondangle']):g}"
+            f"_ar{float(args['min_aspect_ratio']):g}_ang{float(args['min_angle']):g}.hdf5")
+    return os.path.join(cache_dir, name)
+
+
+def open_cache(filename, mode = "r", retries = 120):
+    """Opens a cache file, waiting for other jobs which may currently hold it."""
+    for attempt in range(retries):
+        try:
+            return h5py.File(filename, mode)
+        except BlockingIOError:
+            time.sleep(1.0)
+    return h5py.File(filename, mode)
+
+
+def generate_configs(args, comm, nconfigs):
+    """Draws walkers from the prior in parallel, each rank filling its own simulation boxes in batches.
+    Arguments:
+        args: Dictionary of simulation parameters, hs_alkane must already be initialised.
+        comm: Communicator over which the work is shared.
+        nconfigs: Total number of walkers to generate.
+    Returns:
+        cells, coords: Arrays of shape (nconfigs,3,3) and (nconfigs,nchains*nbeads,3) on rank 0, None elsewhere."""
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    nbeads = args["nbeads"]
+    nchains = args["nchains"]
+    nboxes = args.get("nboxes",args["nwalkers"])
+    nlocal = nconfigs//size + (rank < nconfigs%size)
+
+    cells = np.empty((nlocal,3,3))
+    coords = np.empty((nlocal,nchains*nbeads,3))
+    for start in range(0,nlocal,nboxes):
+        boxes = range(1,min(nboxes,nlocal-start)+1)
+        NS.create_prior_configs(args, boxes = boxes)
+        for ibox in boxes:
+            k = start+ibox-1
+            NS.get_walker_state(ibox,nbeads,nchains,out=NS.WalkerState(cells[k],coords[k].reshape(nchains,nbeads,3)))
+
+    gathered = comm.gather((cells,coords),root=0)
+    if rank != 0:
+        return None, None
+    return np.concatenate([c[0] for c in gathered]), np.concatenate([c[1] for c in gathered])
+
+
+def append_to_cache(filename, args, cells, coords):
+    """Adds walkers to a cache file, creating it if needed."""
+    with open_cache(filename,"a") as f:
+        if "cells" not in f:
+            natoms = args["nchains"]*args["nbeads"]
+            f.create_dataset("cells",(0,3,3),maxshape=(None,3,3),chunks=(64,3,3),dtype="float64")
+            f.create_dataset("coordinates",(0,natoms,3),maxshape=(None,natoms,3),chunks=(1,natoms,3),dtype="float64")
+            for key in ["nchains","nbeads","bondlength","bondangle","min_aspect_ratio","min_angle"]:
+                f.attrs[key] = args[key]
+            f.attrs["n_used"] = 0
+        n = f["cells"].shape[0]
+        f["cells"].resize(n+len(cells),axis=0)
+        f["coordinates"].resize(n+len(cells),axis=0)
+        f["cells"][n:] = cells
+        f["coordinates"][n:] = coords
+
+
+def load_initial_configs(args, comm, cache_dir):
+    """Fills the walkers of every rank from the cache, reserving a block of unused cached walkers for this
+    run. Walkers the cache cannot supply are drawn from the prior by the rank which needs them.
+    Arguments:
+        args: Dictionary of simulation parameters, hs_alkane must already be initialised.
+        comm: Communicator of the run.
+        cache_dir: Directory holding the cache files.
+    Returns:
+        n_cached: Number of walkers taken from the cache over all ranks."""
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    nbeads = args["nbeads"]
+    nchains = args["nchains"]
+    nwalkers = args["nwalkers"]
+    filename = cache_filename(args,cache_dir)
+
+    reserved = None
+    if rank == 0:
+        start = n_take = 0
+        if os.path.exists(filename):
+            with open_cache(filename,"a") as f:
+                start = int(f.attrs["n_used"])
+                n_take = min(nwalkers*size, f["cells"].shape[0]-start)
+                f.attrs["n_used"] = start+n_take
+        reserved = (start,n_take)
+    start, n_take = comm.bcast(reserved,root=0)
+
+    first = rank*nwalkers
+    n_local = int(np.clip(n_take-first,0,nwalkers))
+    if n_local > 0:
+        with open_cache(filename,"r") as f:
+            cells = f["cells"][start+first:start+first+n_local]
+            coords = f["coordinates"][start+first:start+first+n_local]
+        for j in range(n_local):
+            NS.set_walker_state(j+1,NS.WalkerState(cells[j],coords[j].reshape(nchains,nbeads,3)))
+    if n_local < nwalkers:
+        NS.create_prior_configs(args, boxes = range(n_local+1,nwalkers+1))
+    return n_take
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Pre-generate initial walkers into a cache, in parallel when run under MPI")
+    p.add_argument("-f","--input_file",type=str,default="input.txt",help="input file giving the chain model and cell constraints")
+    p.add_argument("-n","--nconfigs",type=int,required=True,help="number of walkers to add to the cache")
+    p.add_argument("-c","--cache_dir",type=str,default="config_cache",help="directory holding the cache files")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    cl_args = parse_cli()
+    args = NSio.read_hans_file(cl_args.input_file)
+    NS.initialise_sim_cells(args,quiet=1)
+    cells, coords = generate_configs(args,comm,cl_args.nconfigs)
+    if comm.Get_rank() == 0:
+        os.makedirs(cl_args.cache_dir,exist_ok=True)
+        filename = cache_filename(args,cl_args.cache_dir)
+        append_to_cache(filename,args,cells,coords)
+        print(f"Added {len(cells)} walkers to {filename}")
@@ -4,6 +4,7 @@
 
 from __future__ import print_function
 import numpy as np, fileinput, itertools, sys, argparse
+from NesSa import samplelog
 
 def parse_cli():
     p = argparse.ArgumentParser()
@@ -29,6 +30,10 @@ def parse_cli():
 
 def read_inputs(args, line_skip=0, line_end=None, interval=1):
 
+    if samplelog.is_sample_log(args):
+        # binary sample log written by mpihans, read through a memory map
+        return samplelog.read_inputs(args, line_skip=line_skip, line_end=line_end, interval=interval)
+
     inputs = fileinput.input(files=args)
 
     fields = inputs.readline().split()
@@ -54,6 +59,7 @@ def read_inputs(args, line_skip=0, line_end=None, interval=1):
 
     Es=[]
     Vs=[]
+    Ks=[]
     lines = itertools.islice(inputs, line_skip, line_end, interval)
     n_fields = None
     for line in lines:
@@ -61,7 +67,20 @@ def read_inputs(args, line_skip=0, line_end=None, interval=1):
         if n_fields is not None and n_fields != len(fields):
             sys.stderr.write(f'Mismatch field # prev {n_fields} cur {len(fields)}, skipping\n')
             continue
-        if len(fields) == 3:
+        if len(fields) == 4:
+            # dynamic nested sampling, last field is the number of live walkers when the sample was culled
+            try:
+                E = float(fields[1])
+                V = float(fields[2])
+                K = int(fields[3])
+            except:
+                continue
+            if n_fields is None:
+                n_fields = 4
+            Es.append(E)
+            Vs.append(V)
+            Ks.append(K)
+        elif len(fields) == 3:
             try:
                 E = float(fields[1])
                 V = float(fields[2])
@@ -80,16 +99,22 @@ def read_inputs(args, line_skip=0, line_end=None, interval=1):
                 n_fields = 2
             Es.append(E)
         else: # silently skip lines with problems
-            sys.stderr.write("WARNING: input line with problem: number of fields not 2 or 3, or not floats\n")
+            sys.stderr.write("WARNING: input line with problem: number of fields not 2, 3 or 4, or not floats\n")
             continue
 
     if len(Vs) == 0:
         Vs = None
     else:
         Vs = np.array(Vs)
-    return (n_walkers, n_cull, n_Extra_DOF, flat_V_prior, N_atoms, np.array(Es), Vs)
+    if len(Ks) == 0:
+        Ks = None
+    else:
+        Ks = np.array(Ks)
+    return (n_walkers, n_cull, n_Extra_DOF, flat_V_prior, N_atoms, np.array(Es), Vs, Ks)
 
-def calc_log_a(n_Es, n_walkers, n_cull, interval=1):
+def calc_log_a(n_Es, n_walkers, n_cull, interval=1, Ks=None):
+    if Ks is not None:
+        return calc_log_a_variable(Ks, n_cull, interval)
     # log_a = math.log(float(n_walkers)) - math.log(float(n_walkers+n_cull))
     # From SENS paper PRX v. 4 p 031034 (2014) Eq. 3
     i_range = np.array(range(n_Es*interval))
@@ -109,6 +134,20 @@ def calc_log_a(n_Es, n_walkers, n_cull, interval=1):
     log_a = log_X_n[0::interval] - np.log(n_walkers+1-i_range_plus_1_mod_n_cull[0::interval])
     return log_a
 
+def calc_log_a_variable(Ks, n_cull=1, interval=1):
+    # Prior volumes for a varying number of live walkers K_n (dynamic nested sampling).
+    # Walkers are added without producing a sample and culled one at a time, so that
+    # X_n = \prod_{i=0}^n \frac{K_i}{K_i+1} and a_n = X_n - X_(n+1) = X_n/(K_(n+1)+1)
+    if n_cull != 1:
+        raise ValueError("variable numbers of walkers are only supported with n_cull = 1")
+    if interval != 1:
+        raise ValueError("variable numbers of walkers need every line, interval must be 1")
+    Ks = np.asarray(Ks, dtype=np.float64)
+    log_X_n = np.cumsum(np.log(Ks) - np.log(Ks+1.0))
+    K_next = np.append(Ks[1:], Ks[-1:])
+    log_a = log_X_n - np.log(K_next+1.0)
+    return log_a
+
 def calc_Z_terms(beta, log_a, Es, flat_V_prior=False, N_atoms=0, Vs=None):
     #DEBUG for i in range(len(log_a)):
         #DEBUG print "calc_Z_terms log_a ", log_a[i], beta*Es[i]
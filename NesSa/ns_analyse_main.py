@@ -25,7 +25,7 @@ def analyse(inputs=None):
     else:
         sum=np.sum
 
-    (n_walkers, n_cull, n_Extra_DOF, flat_V_prior, N_atoms, Es, Vs) = ns_analyse.read_inputs(args.files, line_skip=args.skip, line_end=args.line_end, interval=args.interval)
+    (n_walkers, n_cull, n_Extra_DOF, flat_V_prior, N_atoms, Es, Vs, Ks) = ns_analyse.read_inputs(args.files, line_skip=args.skip, line_end=args.line_end, interval=args.interval)
 
     try:
         from mpi4py import MPI
@@ -38,11 +38,11 @@ def analyse(inputs=None):
 
 
     if reweight_delta_P != 0.0:
-        Es += reweight_delta_P*Vs
+        Es = Es + reweight_delta_P*Vs
 
     E_min_i = np.argmin(Es)
     E_min = Es[E_min_i]
-    Es -= E_min
+    Es = Es - E_min #a new array, Es may be a read-only memory map of a sample log
 
     if args.kolmogorov_smirnov_test:
         from scipy import stats
@@ -123,7 +123,7 @@ def analyse(inputs=None):
         return (log_Z, Helmholtz_F, U, Cvp, low_percentile_config, mode_config, high_percentile_config, Z_fract, V, ks_gaussianity, thermal_exp)
 
 
-    log_a = ns_analyse.calc_log_a(len(Es), n_walkers, n_cull, interval=args.interval)
+    log_a = ns_analyse.calc_log_a(len(Es), n_walkers, n_cull, interval=args.interval, Ks=Ks)
 
     if comm_rank == 0:
         # check this: a = N_w/(N_w+N_c)
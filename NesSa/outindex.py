@@ -0,0 +1,241 @@
+import argparse
+import glob
+import os
+import numpy as np
+
+#Sidecar indexes of the text outputs, volumes.txt and traj.extxyz. Next to each output a file with the
+#suffix .idx holds, for every record written, the iteration it belongs to and the byte offset at which
+#it starts. Entries are appended after the records they describe, so the index may lag behind its output
+#after a crash but never runs ahead of it. Truncating an output on restart is then a lookup and a call to
+#os.truncate instead of reading and rewriting the whole file, and any iteration or frame can be read by
+#seeking straight to it.
+#
+#The trajectory is written by every rank, each to its own file, e.g. traj.rank3.extxyz, with its own
+#index, as appending to a shared file is not safe on the network filesystems of clusters. `merge`
+#writes the frames of every rank as one indexed traj.extxyz, in order of iteration.
+
+index_dtype = np.dtype([("iter","<i8"),("offset","<i8")])
+
+
+def index_filename(filename):
+    return filename + ".idx"
+
+
+def read_index(filename):
+    """Maps the index of an output into memory.
+    Arguments:
+        filename: Indexed output, not the index itself.
+    Returns:
+        entries: Read-only array of entries, None if the output has no index."""
+    idx = index_filename(filename)
+    if not os.path.exists(idx):
+        return None
+    n_entries = os.path.getsize(idx)//index_dtype.itemsize
+    if n_entries == 0:
+        return np.zeros(0, dtype=index_dtype)
+    return np.memmap(idx, dtype=index_dtype, mode="r", shape=(n_entries,))
+
+
+def append_entries(filename, entries):
+    """Adds entries for records that have just been written to an output.
+    An entry at offset 0 starts a new index, replacing one left by an earlier output of the same name."""
+    if len(entries) == 0:
+        return
+    mode = "wb" if entries[0]["offset"] == 0 else "ab"
+    with open(index_filename(filename), mode) as f:
+        f.write(np.asarray(entries, dtype=index_dtype).tobytes())
+
+
+def offset_of(filename, i):
+    """Returns:
+        offset: Byte offset at which the record of iteration i starts in an indexed output.
+    Raises KeyError if iteration i has no record in the index."""
+    entries = read_index(filename)
+    if entries is not None:
+        k = np.searchsorted(entries["iter"], i)
+        if k < len(entries) and entries["iter"][k] == i:
+            return int(entries["offset"][k])
+    raise KeyError(f"iteration {i} is not indexed in {filename}")
+
+
+def scan_lines(f, cutoff):
+    """Finds the first line of volumes.txt from iteration cutoff onwards, reading from the current position of f.
+    Returns:
+        offset: Byte offset of the line, None if there is none."""
+    offset = f.tell()
+    for line in iter(f.readline, b""):
+        fields = line.split()
+        if not line.endswith(b"\n") or (fields and int(fields[0]) >= cutoff): #a partial line is dropped too
+            return offset
+        offset += len(line)
+    return None
+
+
+def scan_frames(f, cutoff):
+    """Finds the first extxyz frame from iteration cutoff onwards, reading from the current position of f.
+    Frames without an iter key in their comment line are kept, a partial frame is dropped.
+    Returns:
+        offset: Byte offset of the frame, None if there is none."""
+    offset = f.tell()
+    for line in iter(f.readline, b""):
+        comment = f.readline()
+        for field in comment.split():
+            if field.startswith(b"iter=") and int(field[5:]) >= cutoff:
+                return offset
+        lines = [f.readline() for _ in range(int(line))]
+        if not lines[-1:] or not lines[-1].endswith(b"\n"):
+            return offset
+        offset = f.tell()
+    return None
+
+
+def truncate(filename, cutoff, scan):
+    """Drops every record of an indexed output from iteration cutoff onwards, along with their index entries.
+    Arguments:
+        filename: Indexed output.
+        cutoff: First iteration to drop.
+        scan: `scan_lines` or `scan_frames`, used to search the part of the output written after the last entry.
+    Returns:
+        truncated: True if records were dropped, False if there were none to drop,
+                   None if the output has no usable index and has to be truncated some other way."""
+    entries = read_index(filename)
+    size = os.path.getsize(filename)
+    if entries is None or len(entries) == 0 or entries["offset"][-1] >= size:
+        return None #missing, or left over from an output that has since been replaced
+    k = np.searchsorted(entries["iter"], cutoff)
+    if k < len(entries):
+        offset = int(entries["offset"][k])
+    else:
+        #the last records may have been written without their entries
+        with open(filename, "rb") as f:
+            f.seek(int(entries["offset"][-1]))
+            offset = scan(f, cutoff)
+    del entries #release the memory map before resizing the file
+    if offset is None or offset >= size:
+        return False
+    os.truncate(filename, offset)
+    os.truncate(index_filename(filename), k*index_dtype.itemsize)
+    return True
+
+
+class TextLog:
+    """Writes volumes.txt in blocks, indexing every line by its iteration.
+        Arguments:
+            filename: Volumes file to create, or to append to if it already exists.
+            n_walkers, n_cull, n_extra_dof, flat_V_prior, n_atoms: Values of the first line. Ignored when appending.
+            block: Number of lines buffered before they are written.
+            writer: Optional `AsyncWriter` performing the writes in the background."""
+
+    def __init__(self, filename, n_walkers=0, n_cull=1, n_extra_dof=0, flat_V_prior=False, n_atoms=0, block=4096, writer=None):
+        self.filename = filename
+        self.writer = writer
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.file = open(filename, "ab")
+        else:
+            self.file = open(filename, "wb")
+            if os.path.exists(index_filename(filename)):
+                os.remove(index_filename(filename)) #left over from an earlier file
+            self.file.write(f"{n_walkers} {n_cull} {n_extra_dof} {flat_V_prior} {n_atoms} \n".encode())
+            self.file.flush()
+        self.offset = self.file.tell()
+        self.lines = []
+        self.entries = np.zeros(block, dtype=index_dtype)
+        self.n = 0
+
+    def append(self, i, vol, n_walkers=0):
+        """Adds the sample culled at iteration i, with n_walkers live walkers if that varies during the run."""
+        if n_walkers:
+            line = f"{i} {vol:.13f} {vol:.13f} {n_walkers} \n".encode()
+        else:
+            line = f"{i} {vol:.13f} {vol:.13f} \n".encode()
+        self.lines.append(line)
+        self.entries[self.n] = (i, self.offset)
+        self.offset += len(line)
+        self.n += 1
+        if self.n == len(self.entries):
+            self.flush()
+
+    def flush(self):
+        """Writes out the buffered lines and their index entries."""
+        data = b"".join(self.lines)
+        entries = self.entries[:self.n].copy()
+        self.lines = []
+        self.n = 0
+        if self.writer is not None:
+            self.writer.submit(self._write, data, entries)
+        else:
+            self._write(data, entries)
+
+    def _write(self, data, entries):
+        self.file.write(data)
+        self.file.flush()
+        append_entries(self.filename, entries)
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.submit(self.file.close)
+        else:
+            self.file.close()
+
+
+def read_lines(filename, i, n=1):
+    """Reads n lines of an indexed volumes file, starting at iteration i, without reading the lines before them.
+    Returns:
+        lines: List of the lines read, as strings."""
+    with open(filename, "rb") as f:
+        f.seek(offset_of(filename, i))
+        return [line.decode() for _, line in zip(range(n), f)]
+
+
+def shards(filename):
+    """Returns:
+        Sorted names of the per rank files of an output, e.g. traj.rank<N>.extxyz for traj.extxyz."""
+    root, ext = os.path.splitext(filename)
+    return sorted(glob.glob(f"{root}.rank*{ext}"))
+
+
+def merge(filename, output=None):
+    """Writes the records of every rank's file of an indexed output as one indexed file, in order of iteration.
+    Arguments:
+        filename: Merged output, e.g. traj.extxyz for the files traj.rank<N>.extxyz.
+        output: File to write, filename if None.
+    Returns:
+        n_records: Number of records written."""
+    records = []
+    for shard in shards(filename):
+        entries = read_index(shard)
+        if entries is None or len(entries) == 0:
+            continue
+        ends = np.append(entries["offset"][1:], os.path.getsize(shard))
+        records += [(int(i), shard, int(start), int(end)) for (i, start), end in zip(entries, ends)]
+        del entries
+    records.sort()
+    output = filename if output is None else output
+    entries = np.zeros(len(records), dtype=index_dtype)
+    files = {}
+    with open(output, "wb") as out:
+        for k, (i, shard, start, end) in enumerate(records):
+            if shard not in files:
+                files[shard] = open(shard, "rb")
+            files[shard].seek(start)
+            entries[k] = (i, out.tell())
+            out.write(files[shard].read(end-start))
+    for f in files.values():
+        f.close()
+    if os.path.exists(index_filename(output)):
+        os.remove(index_filename(output))
+    append_entries(output, entries)
+    return len(records)
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Merge the per rank trajectory files written by mpihans into one file")
+    p.add_argument("file", nargs="?", default="traj.extxyz", help="trajectory to write, e.g. traj.extxyz for traj.rank<N>.extxyz")
+    p.add_argument("-o", "--output", default=None, help="file to write, the trajectory name itself if not given")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    print(f"merged {merge(args.file, args.output)} frames")
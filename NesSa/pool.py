@@ -0,0 +1,184 @@
+import heapq
+import numpy as np
+
+#Volumes of the walkers held on a rank, kept in a contiguous array with an indexed
+#binary max-heap on top of it so that the culled (largest) walker can be found and
+#replaced in O(log n) rather than with max()/list.index() over every walker.
+
+
+class WalkerPool:
+    """Indexed max-heap over the volumes of the walkers held on a rank.
+        Arguments:
+            volumes: Initial volume of every walker, indexed from 0 as in `mpihans`.
+            active: Optional boolean array marking which walkers are live. Inactive walkers
+                    are kept out of the max, top-k and quantile queries."""
+
+    def __init__(self, volumes, active=None):
+        self.volumes = np.array(volumes, dtype=np.float64)
+        if active is None:
+            self.active = np.ones(len(self.volumes), dtype=bool)
+        else:
+            self.active = np.array(active, dtype=bool)
+        self.volumes[~self.active] = -np.inf
+        #a list sorted by decreasing volume is already a valid max-heap
+        self._heap = [int(j) for j in np.argsort(-self.volumes, kind="stable")]
+        self._pos = [0]*len(self._heap)
+        for hpos, iwalker in enumerate(self._heap):
+            self._pos[iwalker] = hpos
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _swap(self, a, b):
+        heap = self._heap
+        heap[a], heap[b] = heap[b], heap[a]
+        self._pos[heap[a]] = a
+        self._pos[heap[b]] = b
+
+    def _sift_up(self, hpos):
+        vols = self.volumes
+        heap = self._heap
+        while hpos > 0:
+            parent = (hpos-1)//2
+            if vols[heap[hpos]] <= vols[heap[parent]]:
+                break
+            self._swap(hpos, parent)
+            hpos = parent
+        return hpos
+
+    def _sift_down(self, hpos):
+        vols = self.volumes
+        heap = self._heap
+        n = len(heap)
+        while True:
+            largest = hpos
+            for child in (2*hpos+1, 2*hpos+2):
+                if child < n and vols[heap[child]] > vols[heap[largest]]:
+                    largest = child
+            if largest == hpos:
+                break
+            self._swap(hpos, largest)
+            hpos = largest
+        return hpos
+
+    def update(self, iwalker, volume):
+        """Sets the volume of a walker and restores the heap ordering.
+        Arguments:
+            iwalker: Index of the walker, starting from 0.
+            volume: New volume of the walker."""
+        self.volumes[iwalker] = volume
+        self._sift_down(self._sift_up(self._pos[iwalker]))
+
+    @property
+    def n_active(self):
+        return int(np.count_nonzero(self.active))
+
+    def active_indices(self):
+        """Returns:
+            Array of the indices of the live walkers."""
+        return np.flatnonzero(self.active)
+
+    def inactive_indices(self):
+        """Returns:
+            Array of the indices of the walkers which are not in use."""
+        return np.flatnonzero(~self.active)
+
+    def activate(self, iwalker, volume):
+        """Marks a walker as live with the given volume."""
+        self.active[iwalker] = True
+        self.update(iwalker, volume)
+
+    def deactivate(self, iwalker):
+        """Removes a walker from the live population without replacing it."""
+        self.active[iwalker] = False
+        self.update(iwalker, -np.inf)
+
+    def max(self):
+        """Returns:
+            vol_max: Largest walker volume in the pool.
+            iwalker: Index of the walker with that volume."""
+        iwalker = self._heap[0]
+        return float(self.volumes[iwalker]), iwalker
+
+    def top_k(self, k):
+        """Returns the k largest walkers in decreasing order of volume, in O(k log k).
+        Arguments:
+            k: Number of walkers to return.
+        Returns:
+            vols: Array of the k largest volumes.
+            iwalkers: Array of the corresponding walker indices."""
+        vols = self.volumes
+        heap = self._heap
+        n = len(heap)
+        k = min(int(k), self.n_active)
+        out_vols = np.empty(k)
+        out_idx = np.empty(k, dtype=np.int64)
+        frontier = [(-vols[heap[0]], 0)] if k > 0 else []
+        for j in range(k):
+            negvol, hpos = heapq.heappop(frontier)
+            out_vols[j] = -negvol
+            out_idx[j] = heap[hpos]
+            for child in (2*hpos+1, 2*hpos+2):
+                if child < n:
+                    heapq.heappush(frontier, (-vols[heap[child]], child))
+        return out_vols, out_idx
+
+    def quantile(self, q):
+        """Quantile(s) of the current walker volume distribution.
+        Arguments:
+            q: Quantile or array of quantiles between 0 and 1.
+        Returns:
+            Volume(s) at the requested quantile(s)."""
+        return np.quantile(self.volumes[self.active], q)
+
+    def summary(self, k=1, nquantiles=0):
+        """Compact description of the pool which can be gathered from every rank and combined
+        using `merge_summaries`.
+        Arguments:
+            k: Number of largest walkers to include.
+            nquantiles: Number of evenly spaced quantiles of the volume distribution to include.
+        Returns:
+            summary: Tuple of (number of walkers, top-k volumes, top-k indices, quantile volumes)."""
+        top_vols, top_idx = self.top_k(k)
+        if nquantiles > 0:
+            qs = self.quantile(np.linspace(0.0, 1.0, nquantiles))
+        else:
+            qs = np.empty(0)
+        return (self.n_active, top_vols, top_idx, qs)
+
+
+def merge_summaries(summaries, k=1, q=None):
+    """Combines the pool summaries of several ranks, e.g. as returned by `comm.allgather(pool.summary(k))`.
+    Arguments:
+        summaries: List of summaries, one per rank, ordered by rank.
+        k: Number of largest walkers to return across all ranks.
+        q: Quantile or array of quantiles of the combined distribution to estimate. Requires the summaries
+           to have been made with nquantiles > 0.
+    Returns:
+        top_vols: The k largest volumes over all ranks.
+        top_ranks: Rank holding each of those walkers.
+        top_idx: Index of each of those walkers on its rank.
+        quantiles: Estimated quantiles of the combined distribution, if q is given."""
+    vols = np.concatenate([s[1] for s in summaries])
+    ranks = np.concatenate([np.full(len(s[1]), r, dtype=np.int64) for r, s in enumerate(summaries)])
+    idx = np.concatenate([s[2] for s in summaries])
+    order = np.argsort(-vols, kind="stable")[:k]
+    top = (vols[order], ranks[order], idx[order])
+    if q is None:
+        return top
+
+    #each rank's quantile points stand for an equal share of that rank's walkers
+    points = []
+    weights = []
+    for n, _, _, qs in summaries:
+        if len(qs) == 0:
+            raise ValueError("Summaries were generated without quantiles.")
+        points.append(qs)
+        weights.append(np.full(len(qs), n/len(qs)))
+    points = np.concatenate(points)
+    weights = np.concatenate(weights)
+    order = np.argsort(points, kind="stable")
+    points = points[order]
+    cum_weights = np.cumsum(weights[order])
+    cum_weights = (cum_weights - 0.5*weights[order])/cum_weights[-1]
+    return top + (np.interp(q, cum_weights, points),)
@@ -0,0 +1,50 @@
+import numpy as np
+from NesSa import MCNS as NS
+
+#Random number streams of a run. Every rank seeds NumPy's global generator, which the rest of the
+#code draws from, with its own stream spawned from a single seed, so runs are reproducible and
+#ranks are independent of each other. hs_alkane's generator state cannot be read back, so it is
+#instead reseeded from the rank's NumPy stream at the start of every iteration. Saving the NumPy
+#state in the restart file is then enough for a restarted run to follow the same trajectory as an
+#uninterrupted one.
+
+
+def seed_rank(seed, comm):
+    """Seeds NumPy's global generator and hs_alkane's generator with this rank's stream.
+    Arguments:
+        seed: Seed of the run, the same on every rank.
+        comm: Communicator of the run."""
+    stream = np.random.SeedSequence(int(seed)).spawn(comm.Get_size())[comm.Get_rank()]
+    np.random.seed(stream.generate_state(4))
+    reseed_alkane()
+
+
+def reseed_alkane():
+    """Reseeds hs_alkane's generator from NumPy's global generator.
+    Returns:
+        seed: The seed given to hs_alkane."""
+    seed = np.random.randint(1, 2**31-1)
+    NS.alk.random_set_random_seed(int(seed))
+    return seed
+
+
+def get_state():
+    """Returns:
+        state: Tuple of arrays describing NumPy's global generator, as written into each rank's restart shard."""
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return keys, pos, has_gauss, cached_gaussian
+
+
+def write_state(grp, state):
+    """Writes a generator state, as returned by `get_state`, into a group of an open restart file."""
+    keys, pos, has_gauss, cached_gaussian = state
+    grp.create_dataset("keys", data=keys)
+    grp.attrs["pos"] = pos
+    grp.attrs["has_gauss"] = has_gauss
+    grp.attrs["cached_gaussian"] = cached_gaussian
+
+
+def read_state(grp):
+    """Restores NumPy's global generator from a group written by `write_state`."""
+    np.random.set_state(("MT19937", grp["keys"][:], int(grp.attrs["pos"]), int(grp.attrs["has_gauss"]),
+                         float(grp.attrs["cached_gaussian"])))
@@ -0,0 +1,166 @@
+import argparse
+import os
+import numpy as np
+
+#Binary alternative to volumes.txt. The file starts with a fixed header holding the same values as
+#the first line of volumes.txt, followed by one fixed size record per culled sample. Records are
+#buffered and appended in blocks, and the analysis reads them back through a memory map instead of
+#parsing text. `export_text` converts a log to the pymatnest text format.
+
+MAGIC = b"NSLOG001"
+header_dtype = np.dtype([("magic","S8"),("n_walkers","<i8"),("n_cull","<i8"),("n_extra_dof","<i8"),
+                         ("flat_V_prior","<i8"),("n_atoms","<i8")])
+#n_walkers is the number of live walkers when the sample was culled, 0 if it was not recorded
+record_dtype = np.dtype([("iter","<i8"),("energy","<f8"),("volume","<f8"),("n_walkers","<i8")])
+
+
+def is_sample_log(filename):
+    """Returns:
+        True if filename is a binary sample log."""
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (OSError, TypeError):
+        return False
+
+
+class SampleLog:
+    """Append-only binary log of culled samples, written in blocks.
+        Arguments:
+            filename: Log to create, or to append to if it already exists.
+            n_walkers, n_cull, n_extra_dof, flat_V_prior, n_atoms: Header values, as on the first line of volumes.txt.
+                                                                  Ignored when appending.
+            block: Number of records buffered before they are written.
+            writer: Optional `AsyncWriter` performing the writes in the background."""
+
+    def __init__(self, filename, n_walkers=0, n_cull=1, n_extra_dof=0, flat_V_prior=False, n_atoms=0, block=4096, writer=None):
+        self.writer = writer
+        if os.path.exists(filename) and os.path.getsize(filename) >= header_dtype.itemsize:
+            self.file = open(filename, "ab")
+        else:
+            self.file = open(filename, "wb")
+            header = np.zeros(1, dtype=header_dtype)
+            header[0] = (MAGIC, n_walkers, n_cull, n_extra_dof, flat_V_prior, n_atoms)
+            self.file.write(header.tobytes())
+        self.buffer = np.zeros(block, dtype=record_dtype)
+        self.n = 0
+
+    def append(self, i, vol, n_walkers=0):
+        """Adds the sample culled at iteration i, with n_walkers live walkers if that varies during the run."""
+        self.buffer[self.n] = (i, vol, vol, n_walkers)
+        self.n += 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """Writes out the buffered records."""
+        data = self.buffer[:self.n].tobytes()
+        self.n = 0
+        if self.writer is not None:
+            self.writer.submit(self._write, data)
+        else:
+            self._write(data)
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.submit(self.file.close)
+        else:
+            self.file.close()
+
+
+def read_sample_log(filename):
+    """Maps a sample log into memory.
+    Returns:
+        header: Record of the header values.
+        records: Read-only array of records, complete records only."""
+    header = np.fromfile(filename, dtype=header_dtype, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError(f"{filename} is not a sample log")
+    n_records = (os.path.getsize(filename)-header_dtype.itemsize)//record_dtype.itemsize
+    if n_records == 0:
+        return header, np.zeros(0, dtype=record_dtype)
+    return header, np.memmap(filename, dtype=record_dtype, mode="r", offset=header_dtype.itemsize, shape=(n_records,))
+
+
+def read_inputs(filename, line_skip=0, line_end=None, interval=1):
+    """Reads a sample log in the same way as `ns_analyse.read_inputs` reads a text file, with records in place of lines.
+    Returns:
+        (n_walkers, n_cull, n_Extra_DOF, flat_V_prior, N_atoms, Es, Vs, Ks), Ks is None unless walker counts were recorded.
+        The arrays are read-only views of the memory mapped log, callers which change them must copy them first."""
+    header, records = read_sample_log(filename)
+    records = records[line_skip:line_end:interval]
+    Ks = None
+    if len(records) and records["n_walkers"].any():
+        Ks = records["n_walkers"]
+    return (int(header["n_walkers"]), int(header["n_cull"]), int(header["n_extra_dof"]), bool(header["flat_V_prior"]),
+            int(header["n_atoms"]), records["energy"], records["volume"], Ks)
+
+
+def truncate_sample_log(filename, n_records):
+    """Drops every record after the first n_records, e.g. those written after the checkpoint a run is restarted from.
+    Returns:
+        True if any records were dropped."""
+    size = header_dtype.itemsize + n_records*record_dtype.itemsize
+    if os.path.getsize(filename) <= size:
+        return False
+    os.truncate(filename, size)
+    return True
+
+
+def export_text(filename, output, chunk=1000000):
+    """Writes a sample log in the text format of volumes.txt, as read by pymatnest's ns_analyse."""
+    header, records = read_sample_log(filename)
+    variable = len(records) and records["n_walkers"].any()
+    with open(output, "w") as out:
+        out.write(f"{header['n_walkers']} {header['n_cull']} {header['n_extra_dof']} {bool(header['flat_V_prior'])} {header['n_atoms']} \n")
+        for start in range(0, len(records), chunk):
+            block = records[start:start+chunk]
+            if variable:
+                np.savetxt(out, np.column_stack([block["iter"], block["energy"], block["volume"], block["n_walkers"]]),
+                           fmt=["%d","%.13f","%.13f","%d"])
+            else:
+                np.savetxt(out, np.column_stack([block["iter"], block["energy"], block["volume"]]), fmt=["%d","%.13f","%.13f"])
+
+
+def check_export(filename, output, T_min=0.01, dT=0.001, n_T=1000):
+    """Exports a sample log with `export_text` and runs `ns_analyse_main.analyse` on both the log and the text file.
+    Returns:
+        True if the two analyses print the same table, to within the rounding of the text format."""
+    import io
+    from contextlib import redirect_stdout
+    from NesSa import ns_analyse_main
+    export_text(filename, output)
+    tables = []
+    for files in (filename, output):
+        nsa_args = {"T_min": T_min, "dT": dT, "n_T": n_T, "kB": 1.0, "accurate_sum": False, "verbose": False,
+                    "profile": False, "skip": 0, "line_end": None, "interval": 1, "delta_pressure": 0.0,
+                    "dump_terms": -1.0, "entropy": False, "quiet": True, "kolmogorov_smirnov_test": False,
+                    "files": files}
+        out = io.StringIO()
+        with redirect_stdout(out):
+            ns_analyse_main.analyse(nsa_args)
+        tables.append(np.loadtxt(io.StringIO(out.getvalue()), ndmin=2))
+    return tables[0].shape == tables[1].shape and np.allclose(tables[0], tables[1], rtol=1e-5, atol=0)
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Convert a binary sample log to the volumes.txt text format")
+    p.add_argument("file", help="sample log to convert")
+    p.add_argument("-o", "--output", default="volumes.txt", help="text file to write")
+    p.add_argument("--check", action="store_true", help="also check that ns_analyse gives the same results for both files")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    if args.check:
+        if not check_export(args.file, args.output):
+            print("ns_analyse results differ between the sample log and the exported text file")
+            raise SystemExit(1)
+    else:
+        export_text(args.file, args.output)
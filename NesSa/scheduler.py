@@ -0,0 +1,69 @@
+import numpy as np
+
+#Choice of which walker to walk on the ranks that do not hold the culled walker. Rather than
+#picking one uniformly at random, walkers which are still close copies of another walker are
+#walked first, and otherwise the walker which has gone longest without being walked.
+
+
+class WalkerScheduler:
+    """Keeps track of how stale the walkers on a rank are.
+        Arguments:
+            nwalkers: Number of walkers (simulation boxes) on the rank.
+            decorrelation_sweeps: Number of sweeps after being cloned, or after being the source of a
+                                  clone, before a walker is treated as independent of its copy."""
+
+    def __init__(self, nwalkers, decorrelation_sweeps):
+        self.decorrelation_sweeps = decorrelation_sweeps
+        self.last_walked = np.full(nwalkers, -1, dtype=np.int64)
+        #initial walkers are independent of each other
+        self.sweeps_since_clone = np.full(nwalkers, decorrelation_sweeps, dtype=np.int64)
+
+    def walked(self, iwalker, i, sweeps):
+        """Records that a walker has been walked.
+        Arguments:
+            iwalker: Index of the walker, starting from 0.
+            i: Current iteration.
+            sweeps: Number of sweeps performed."""
+        self.last_walked[iwalker] = i
+        self.sweeps_since_clone[iwalker] += sweeps
+
+    def cloned(self, iwalker):
+        """Records that a walker has been overwritten by, or used as the source of, a clone."""
+        self.sweeps_since_clone[iwalker] = 0
+
+    def select(self, walkers=None):
+        """Picks the walker to walk next. Walkers that are still copies of another walker come first,
+        least walked first, otherwise the walker walked longest ago is chosen. Ties are broken at random.
+        Arguments:
+            walkers: Indices of the walkers to choose from, all walkers if None.
+        Returns:
+            iwalker: Index of the chosen walker."""
+        if walkers is None:
+            walkers = np.arange(len(self.last_walked))
+        sweeps = self.sweeps_since_clone[walkers]
+        if sweeps.min() < self.decorrelation_sweeps:
+            candidates = walkers[sweeps == sweeps.min()]
+            last_walked = self.last_walked[candidates]
+            candidates = candidates[last_walked == last_walked.min()]
+        else:
+            last_walked = self.last_walked[walkers]
+            candidates = walkers[last_walked == last_walked.min()]
+        return candidates[np.random.randint(len(candidates))]
+
+    def select_many(self, n, walkers=None, exclude=()):
+        """Picks up to n different walkers to walk next, in the order `select` would choose them.
+        Arguments:
+            n: Number of walkers to pick.
+            walkers: Indices of the walkers to choose from, all walkers if None.
+            exclude: Walkers which should not be picked.
+        Returns:
+            chosen: List of walker indices."""
+        if walkers is None:
+            walkers = np.arange(len(self.last_walked))
+        walkers = walkers[~np.isin(walkers, exclude)]
+        chosen = []
+        while len(chosen) < n and len(walkers) > 0:
+            iwalker = self.select(walkers)
+            chosen.append(iwalker)
+            walkers = walkers[walkers != iwalker]
+        return chosen
@@ -0,0 +1,46 @@
+import numpy as np
+
+#Stand-in for an mpi4py communicator holding a single rank, so the nested sampling loop in
+#`mpihans` can run on a workstation or in a notebook without an MPI launcher or mpi4py installed.
+#Only the calls made by the loop and its helpers are provided. With one rank every collective
+#returns the local value, so the `op` of the reductions is accepted and ignored.
+
+
+class SerialComm:
+    """Communicator of a run on a single process."""
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return 1
+
+    def Barrier(self):
+        pass
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def Bcast(self, buf, root=0):
+        pass
+
+    def gather(self, obj, root=0):
+        return [obj]
+
+    def allgather(self, obj):
+        return [obj]
+
+    def allreduce(self, obj, op=None):
+        return obj
+
+    def Allreduce(self, sendbuf, recvbuf, op=None):
+        np.copyto(np.asarray(recvbuf), sendbuf)
+
+
+def get_comm(use_mpi=True):
+    """Returns:
+        comm: MPI.COMM_WORLD if use_mpi is set, importing mpi4py only then, otherwise a `SerialComm`."""
+    if use_mpi:
+        from mpi4py import MPI
+        return MPI.COMM_WORLD
+    return SerialComm()
@@ -0,0 +1,87 @@
+import numpy as np
+from mpi4py import MPI
+from NesSa import MCNS as NS
+
+#Copy of every walker's cell and coordinates kept in memory shared by all the ranks of a node,
+#using an MPI-3 shared window. Ranks publish their walkers into it after changing them, so a
+#clone between two ranks of the same node is a plain memory copy rather than an MPI message.
+#
+#Writes are followed by Win.Sync, and reads are preceded by one, with the collectives of the
+#nested sampling loop in between providing the synchronisation between processes. A clone through
+#the store ends with the destination acknowledging the copy, so the source does not publish over a
+#row that is still being read, see `comms.clone_walker`.
+
+
+class SharedWalkerStore:
+    """Node-shared store of the walkers of every rank on the node.
+        Arguments:
+            comm: Communicator of the run.
+            nboxes: Number of walkers (simulation boxes) per rank.
+            nbeads: Number of beads per chain.
+            nchains: Number of chains."""
+
+    def __init__(self, comm, nboxes, nbeads, nchains):
+        self.nboxes = nboxes
+        self.nbeads = nbeads
+        self.nchains = nchains
+        self.natoms = nbeads*nchains
+        self.record = 9 + 3*self.natoms
+        self.node = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        self.node_rank = self.node.Get_rank()
+        #world rank -> rank within the node, for the ranks sharing this node
+        self.node_ranks = {r: j for j, r in enumerate(self.node.allgather(comm.Get_rank()))}
+
+        itemsize = MPI.DOUBLE.Get_size()
+        self.win = MPI.Win.Allocate_shared(nboxes*self.record*itemsize, itemsize, comm=self.node)
+        self.segments = []
+        for j in range(self.node.Get_size()):
+            buf, _ = self.win.Shared_query(j)
+            self.segments.append(np.ndarray(buffer=buf, dtype=np.float64, shape=(nboxes, self.record)))
+        self.win.Lock_all()
+
+    def on_node(self, world_rank):
+        """Returns:
+            True if world_rank shares this node."""
+        return world_rank in self.node_ranks
+
+    def publish(self, ibox):
+        """Copies one of this rank's simulation boxes into the store.
+        Arguments:
+            ibox: Simulation box to copy, starting from 1."""
+        row = self.segments[self.node_rank][ibox-1]
+        NS.get_walker_state(ibox, self.nbeads, self.nchains,
+                            out=NS.WalkerState(row[:9].reshape(3, 3), row[9:].reshape(self.nchains, self.nbeads, 3)))
+        self.win.Sync()
+
+    def publish_all(self):
+        """Copies every simulation box of this rank into the store and waits for the whole node to do so."""
+        for ibox in range(1, self.nboxes+1):
+            self.publish(ibox)
+        self.node.Barrier()
+        self.win.Sync()
+
+    def read(self, world_rank, ibox):
+        """Returns a view of a walker held in the store by another rank of the node.
+        Arguments:
+            world_rank: Rank holding the walker.
+            ibox: Simulation box of the walker on that rank, starting from 1.
+        Returns:
+            state: `WalkerState` whose arrays are views of the store."""
+        self.win.Sync()
+        row = self.segments[self.node_ranks[world_rank]][ibox-1]
+        return NS.WalkerState(row[:9].reshape(3, 3), row[9:].reshape(self.nchains, self.nbeads, 3))
+
+    def gather_node(self):
+        """Returns views of every walker on the node, e.g. for the node leader to write a checkpoint.
+        Returns:
+            cells: (node ranks, nboxes, 3, 3) array.
+            coords: (node ranks, nboxes, natoms, 3) array."""
+        self.win.Sync()
+        cells = np.stack([seg[:, :9].reshape(self.nboxes, 3, 3) for seg in self.segments])
+        coords = np.stack([seg[:, 9:].reshape(self.nboxes, self.natoms, 3) for seg in self.segments])
+        return cells, coords
+
+    def free(self):
+        self.win.Unlock_all()
+        self.win.Free()
+        self.node.Free()
@@ -0,0 +1,82 @@
+import argparse
+import os
+import numpy as np
+
+#Snapshot of the whole walker population, written as a single .npy file of structured records, one per
+#simulation box on every rank. Rank 0 creates the file at its full size, after which each rank packs its
+#own block of records in memory and writes it at its offset with a single os.pwrite, so the ranks write in
+#parallel and nothing is gathered onto one rank. Blocks are not aligned to pages, so they are not written
+#through a memory map, whose flush would write back whole pages and could overwrite the records of a
+#neighbouring rank on a shared filesystem. The file is read back with np.load, optionally memory mapped.
+
+
+def record_dtype(nbeads, nchains):
+    """Returns:
+        Structured dtype of one walker's record. age is the number of sweeps since the walker was last
+        cloned, and last_walked the iteration it was last walked at, -1 if they are not tracked."""
+    return np.dtype([("rank","<i4"),("index","<i4"),("active","?"),("volume","<f8"),("age","<i8"),
+                     ("last_walked","<i8"),("cell","<f8",(3,3)),("coordinates","<f8",(nchains,nbeads,3))])
+
+
+def create(filename, dtype, n_records):
+    """Creates a snapshot file of n_records records, to be filled in by `write_records`."""
+    with open(filename, "wb") as f:
+        np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                 "fortran_order": False, "shape": (n_records,)})
+        f.truncate(f.tell() + n_records*dtype.itemsize)
+
+
+def header_size(filename):
+    """Returns:
+        Offset in bytes of the first record of a snapshot file."""
+    with open(filename, "rb") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+
+def write_records(filename, start, records):
+    """Writes a block of records into a snapshot file created by `create`, starting at record start."""
+    data = np.ascontiguousarray(records).tobytes()
+    offset = header_size(filename) + start*records.dtype.itemsize
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        while data:
+            n = os.pwrite(fd, data, offset)
+            data, offset = data[n:], offset+n
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_snapshot(filename, mmap=True):
+    """Returns:
+        Array of the records of a snapshot, memory mapped read-only if mmap."""
+    return np.load(filename, mmap_mode="r" if mmap else None)
+
+
+def summary(records):
+    """Returns:
+        Lines describing the spread of volumes and ages of the live walkers on each rank."""
+    lines = []
+    for r in np.unique(records["rank"]):
+        live = records[(records["rank"] == r) & records["active"]]
+        vq = np.quantile(live["volume"], [0,0.5,1]) if len(live) else [np.nan]*3
+        aq = np.quantile(live["age"], [0,0.5,1]) if len(live) else [np.nan]*3
+        lines.append(f"rank {r:<4} live {len(live):<6} volume min/median/max {vq[0]:.4f} {vq[1]:.4f} {vq[2]:.4f} "
+                     f"age min/median/max {aq[0]:.0f} {aq[1]:.0f} {aq[2]:.0f}")
+    return lines
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Summarise a walker population snapshot written by mpihans")
+    p.add_argument("file", help="snapshot file, e.g. snapshot.1000.npy")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    for line in summary(read_snapshot(args.file)):
+        print(line)
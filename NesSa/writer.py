@@ -0,0 +1,54 @@
+import queue
+import threading
+
+#Background thread taking file output off the critical path of the nested sampling loop. Writes are
+#handed over as a function and its arguments, which must be copies that the loop no longer changes,
+#and are performed in order. The queue is bounded, so a stalled filesystem eventually holds the loop
+#up rather than letting pending output grow without limit. The thread never makes MPI calls.
+
+
+class AsyncWriter:
+    """Thread performing writes in the background, in the order they were submitted.
+        Arguments:
+            maxsize: Largest number of pending writes, beyond which `submit` waits for the thread to catch up."""
+
+    def __init__(self, maxsize=1024):
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None: #once a write has failed the rest are dropped, the error is raised by the loop
+                    func, args, kwargs = task
+                    func(*args, **kwargs)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("A background write failed") from self.error
+
+    def submit(self, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) to be run by the writer thread."""
+        self._check()
+        self.queue.put((func, args, kwargs))
+
+    def flush(self):
+        """Waits until every write submitted so far has been performed."""
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        """Performs the remaining writes and stops the thread."""
+        self.queue.join()
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
@@ -1,25 +1,49 @@
 from timeit import default_timer as timer
 import sys
-from mpi4py import MPI
 from NesSa import MCNS as NS
 from NesSa import NSio
-#from numpy.random import MT19937
-#from numpy.random import RandomState, SeedSequence
+from NesSa.pool import WalkerPool
+from NesSa.convergence import EvidenceTracker
+from NesSa.dynamic import WalkerSchedule, read_walker_schedule
+from NesSa.scheduler import WalkerScheduler
+from NesSa import initcache
+from NesSa import comms
+from NesSa import rng
+from NesSa.executor import WalkExecutor
+from NesSa.serial import get_comm
+from NesSa.writer import AsyncWriter
+from NesSa import checkpoint
+from NesSa import samplelog
+from NesSa import outindex
+from NesSa import h5traj
 import os
-import ase.io
-import h5py
 import numpy as np
 from NesSa import ns_analyse_main
 
-#import signal
 
+def walk_walkers(SimParams, walkers, move_ratio, volume_limit, dshear, dstretch, executor=None):
+    """Performs a Monte Carlo walk on each of the given walkers, concurrently if an executor is given.
+    Returns:
+        results: List of (volume, acceptance rates) for each walker."""
+    if executor is not None:
+        return executor.walk([iwalker+1 for iwalker in walkers], SimParams["walklength"], move_ratio, volume_limit,
+                             dshear = dshear, dstretch = dstretch)
+    return [NS.MC_run(SimParams,SimParams["walklength"], move_ratio,iwalker+1, volume_limit=volume_limit,
+                      min_ar=SimParams["min_aspect_ratio"], min_ang= SimParams["min_angle"],
+                      dshear = dshear, dstretch = dstretch) for iwalker in walkers]
+
+def main(SimParams, comm=None):
+    """Runs nested sampling over all ranks of comm.
+        Arguments:
+            SimParams: Dictionary of simulation parameters.
+            comm: Communicator of the run, MPI.COMM_WORLD if None. A `serial.SerialComm` runs on a single
+                  process without MPI, using `walk_workers` processes to walk walkers in parallel."""
+    if comm is None:
+        comm = get_comm()
+    size = comm.Get_size()
+    rank = comm.Get_rank()
+    t0 = timer()
 
-comm = MPI.COMM_WORLD
-size = comm.Get_size()
-rank = comm.Get_rank()
-t0 = MPI.Wtime()
-
-def main(SimParams):
     #constants for MC adjust stuff
     dv_max = 50.0 #max vol move allowed
     dr_max = 50.0 #max trans move allowed
@@ -35,8 +59,6 @@ def main(SimParams):
 
     mc_aargsdjust_wl = max(10//size,1)
 
-    traj_interval = 100
-    
     #############################################################################
     directory = None
     from_restart = None
@@ -63,7 +85,14 @@ def main(SimParams):
             else:
                 print("No directory specified, using default")
                 directory = "./"
-
+            if "initial_config" in SimParams:
+                SimParams["initial_config"] = os.path.abspath(SimParams["initial_config"])
+            if "config_cache" in SimParams:
+                SimParams["config_cache"] = os.path.abspath(SimParams["config_cache"])
+            if "walker_schedule" in SimParams:
+                SimParams["walker_ranges"] = read_walker_schedule(SimParams["walker_schedule"])
+        if not "seed" in SimParams:
+            SimParams["seed"] = int(np.random.SeedSequence().entropy % 2**63) #recorded in the restart file
 
     directory = comm.bcast(directory,root=0)
     os.chdir(f"{directory}")
@@ -75,20 +104,23 @@ def main(SimParams):
         SimParams["prev_iters"] = 0
 
     if from_restart:
-        f = h5py.File(SimParams["restart_file"], "r")
+        restart_attrs = NSio.restart_attrs(SimParams["restart_file"]) #including the latest delta checkpoint
 
-        for i in f.attrs:
-            if i != "restart_file" and i != "time":
-                SimParams[i] = f.attrs[i]
+        for i in restart_attrs:
+            if i != "restart_file" and i != "time" and i != "nranks" and i != "ndeltas":
+                SimParams[i] = restart_attrs[i]
                 if isinstance(SimParams[i],np.floating):
                     SimParams[i] = float(SimParams[i])
                 elif isinstance(SimParams[i],np.integer):
                     SimParams[i] = int(SimParams[i])
                 else:
                     continue
-        f.close()
+    traj_interval = SimParams["traj_interval"]
+    volumes_file = "volumes.nslog" if SimParams.get("sample_log",False) else "volumes.txt"
+    if from_restart:
+        restart_nboxes = NSio.restart_boxes_per_rank(SimParams["restart_file"],size)
         if rank == 0:
-                NSio.restart_cleanup(SimParams,traj_interval)
+                NSio.restart_cleanup(SimParams,traj_interval,volumes_file)
             # pass
             
         comm.Barrier()   
@@ -103,17 +135,31 @@ def main(SimParams):
                 print (f"{arg:<16} {SimParams[arg]}")
 
 
+    schedule = None
+    if "walker_ranges" in SimParams:
+        #dynamic nested sampling, enough boxes are allocated for the largest number of walkers requested
+        schedule = WalkerSchedule(SimParams["walker_ranges"],SimParams["nwalkers"])
+        SimParams["nboxes"] = schedule.max_walkers()
+    else:
+        SimParams["nboxes"] = SimParams["nwalkers"]
+    if from_restart:
+        #the restart file may have been written by a different number of ranks, its walkers are shared
+        #out evenly with any spare boxes left inactive
+        if schedule is None:
+            SimParams["nwalkers"] = SimParams["nboxes"] = restart_nboxes
+        else:
+            SimParams["nboxes"] = max(SimParams["nboxes"],restart_nboxes)
+
     move_ratio=NS.default_move_ratio(SimParams) #generating a move ratio
     SimParams["move_ratio"] = move_ratio #writing here so it gets written to restart
 
-    # rs = RandomState(MT19937(SeedSequence(2451))) #random seed
-
     if rank:
         quiet = 1
     else:
         quiet = 0
 
     NS.initialise_sim_cells(SimParams,quiet = quiet) #initialise data structure
+    rng.seed_rank(SimParams["seed"],comm) #independent stream for each rank
 
     if "dv_max" in SimParams:
         NS.alk.alkane_set_dv_max(float(SimParams["dv_max"])) #set step sizes
@@ -150,40 +196,83 @@ def main(SimParams):
             if rank == 0:
                 print("Loading initial config")
             
-            try:
-                for i in range(SimParams["nwalkers"]):
-                    initial_config = ase.io.read(f'../{SimParams["initial_config"]}')
-                    NS.import_ase_to_ibox(initial_config,i+1,SimParams)
-            except OSError:
-                print(f"Cannot locate {SimParams['initial_config']} in {os.getcwd()}")
-                sys.exit(1)
-            if 'initial_config' in globals():
-                assert(initial_config.get_number_of_atoms() == SimParams["nwalkers"]*SimParams["nbeads"]), "Initial config has wrong number of atoms"
-
+            cells, positions = NSio.read_initial_configs(SimParams["initial_config"],comm,SimParams["nbeads"],SimParams["nchains"])
+            for i in range(SimParams["nwalkers"]):
+                iframe = (rank*SimParams["nwalkers"]+i)%len(cells) #frames are shared out round-robin over all walkers
+                NS.set_walker_state(i+1,NS.WalkerState(cells[iframe],positions[iframe].reshape(SimParams["nchains"],SimParams["nbeads"],3)))
+
+            NS.perturb_initial_configs(SimParams,move_ratio, SimParams["initial_walk"]) #random walk helps to distribute box sizes.
+        elif "config_cache" in SimParams:
+            n_cached = initcache.load_initial_configs(SimParams,comm,SimParams["config_cache"]) #pre-generated prior draws
+            if rank == 0:
+                print(f"Took {n_cached} of {SimParams['nwalkers']*size} initial walkers from the cache")
+        elif SimParams.get("prior_init",False) or SimParams.get("prior_init_approximate",False):
+            NS.create_prior_configs(SimParams) #independent draws from the prior, no equilibration needed
         else:
             NS.create_initial_configs(SimParams) #creating initial configs
-        NS.perturb_initial_configs(SimParams,move_ratio, SimParams["initial_walk"]) #random walk helps to distribute box sizes.
+            NS.perturb_initial_configs(SimParams,move_ratio, SimParams["initial_walk"]) #random walk helps to distribute box sizes.
     else: # load from restart
-        f = h5py.File(SimParams["restart_file"], "r")
-        dshear = f.attrs["dshear"]
-        dstretch = f.attrs["dstretch"]
-
-        for iwalker in range(1,SimParams["nwalkers"]+1):
-            groupname = f"walker_{rank}_{iwalker:04d}"
-            cell = f[groupname]["unitcell"][:]
-            NS.alk.box_set_cell(iwalker,cell)
-            new_coords = f[groupname]["coordinates"][:]
-            for ichain in range(0,SimParams["nchains"]):
-                coords = NS.alk.alkane_get_chain(ichain+1,iwalker)
-                for ibead in range(SimParams["nbeads"]):
-                    coords[ibead] = new_coords[ichain*SimParams["nbeads"]+ibead]
+        dshear = restart_attrs["dshear"]
+        dstretch = restart_attrs["dstretch"]
 
-        f.close()
+        cells, positions, loaded_active, sched_state = NSio.read_restart_walkers(SimParams["restart_file"],comm)
+        if min(comm.allgather(len(cells))) == 0:
+            if rank == 0:
+                print(f"Restart file holds too few live walkers to share out over {size} ranks")
+            sys.exit(1)
+        positions = positions.reshape(len(cells),SimParams["nchains"],SimParams["nbeads"],3)
+        for iwalker in range(len(cells)):
+            NS.set_walker_state(iwalker+1,NS.WalkerState(cells[iwalker],positions[iwalker]))
+        active = np.zeros(SimParams["nboxes"],dtype=bool)
+        active[:len(cells)] = loaded_active
+        n_replaced = comm.allreduce(NSio.revalidate_walkers(loaded_active)) #before the random streams are restored
+        if rank == 0 and n_replaced:
+            print(f"Replaced {n_replaced} walkers which overlapped after loading from the restart file")
+
+        if not NSio.read_restart_rng(SimParams["restart_file"],comm):
+            rng.seed_rank(SimParams["seed"]+SimParams["prev_iters"],comm) #new rank count, or no saved state
 
-    vols=[NS.alk.box_compute_volume(i) for i in range(1,SimParams["nwalkers"]+1)]
+    if not from_restart:
+        active = np.arange(SimParams["nboxes"]) < SimParams["nwalkers"]
+    pool = WalkerPool([NS.alk.box_compute_volume(i) for i in range(1,SimParams["nboxes"]+1)],active)
+    live_mask = np.array(comm.allgather(pool.active)) #which walkers are live on every rank
+    n_live = int(live_mask.sum())
+    store = None
+    if SimParams.get("shared_store",False) and size > 1:
+        from NesSa.sharedstore import SharedWalkerStore
+        store = SharedWalkerStore(comm,SimParams["nboxes"],SimParams["nbeads"],SimParams["nchains"])
+        store.publish_all()
+    executor = None
+    if SimParams.get("walk_workers",0) > 0:
+        executor = WalkExecutor(SimParams,SimParams["walk_workers"])
+    scheduler = WalkerScheduler(SimParams["nboxes"],SimParams.get("decorrelation_sweeps",SimParams["walklength"]))
+    if from_restart and sched_state is not None:
+        scheduler.last_walked[:len(cells)], scheduler.sweeps_since_clone[:len(cells)] = sched_state
 
     mc_adjust_interval = max((SimParams["nwalkers"]*size)//2,1) #ns_adjust interval steps, same as pymatnest
 
+    checkpointer = checkpoint.CheckpointScheduler(t0,SimParams.get("time"),SimParams["max_lost_time"])
+    checkpointer.install_handlers() #on every rank, so SIGTERM does not kill ranks before the final checkpoint
+    delta_interval = SimParams.get("delta_interval",0)
+    snapshot_interval = SimParams.get("snapshot_interval",0)
+    changed = np.zeros(SimParams["nboxes"],dtype=bool) #walkers changed since the last checkpoint
+    n_deltas = -1 #deltas since this run's last full checkpoint, none has been written yet
+    writer = None
+    if SimParams.get("async_io",False):
+        writer = AsyncWriter() #volumes, trajectory and checkpoint shards are written in the background
+    pending = None #checkpoint whose shards are still being written
+    traj = None
+    traj_bits = SimParams.get("traj_bits",0) or None #quantised coordinates for the trajectory and archive, exact if 0
+    if SimParams.get("hdf5_traj",False):
+        traj = h5traj.TrajectoryWriter(NSio.shard_filename("traj.hdf5",rank),SimParams["nbeads"],SimParams["nchains"],
+                                       bits=traj_bits,writer=writer)
+    archive = None
+    if SimParams.get("culled_archive",False):
+        #every culled walker, with the iteration of its line in the volumes file
+        archive = h5traj.TrajectoryWriter(NSio.shard_filename("culled.hdf5",rank),SimParams["nbeads"],SimParams["nchains"],
+                                          block=256,bits=traj_bits,writer=writer)
+    commit_lag = 100 #iterations after which a background checkpoint is completed
+
 
 #calculating degrees of freedom
     dof = 0
@@ -196,82 +285,186 @@ def main(SimParams):
             dof+= 3*SimParams["nchains"] #kinetic degrees of freedom for ns_analyse
 
     f = None
+    evidence = None
     if rank == 0:
-        f = open(f"volumes.txt","a+")
-        if not from_restart:
-            f.write(f'{SimParams["nwalkers"]*size} {1} {dof} {False} {SimParams["nchains"]} \n')
+        if SimParams.get("sample_log",False):
+            f = samplelog.SampleLog(volumes_file,n_live,1,dof,False,SimParams["nchains"],writer=writer)
+        else:
+            f = outindex.TextLog(volumes_file,n_live,1,dof,False,SimParams["nchains"],writer=writer)
+        if "max_betaP" in SimParams:
+            evidence = EvidenceTracker(n_live, SimParams["max_betaP"])
+            if from_restart:
+                f.flush()
+                evidence.replay(volumes_file)
     sys.stdout.flush()
 #######################################################################################
 # NESTED SAMPLING LOOP                                                                #
 #######################################################################################
     ns_t0 = timer()
-    interrupted = False
-    #signal.signal(signal.SIGTERM, NS.signal_handler)
     for i in range(SimParams["prev_iters"],SimParams["prev_iters"]+int(SimParams["iterations"])):
-        local_max = max(vols)
-        local_max_index = [rank,vols.index(local_max)]
-
-
-        vol_max,vol_max_index = comm.allreduce([local_max,local_max_index],op=MPI.MAXLOC)
-
+        if pending is not None and i >= commit_at:
+            NSio.commit_restart(comm,pending,writer)
+            pending = None
+        rng.reseed_alkane() #so hs_alkane's stream can be recovered from NumPy's on restart
+        local_max, local_max_iwalker = pool.max()
+
+        vol_max,vol_max_index = comms.global_max(comm,local_max,local_max_iwalker,SimParams["nboxes"])
+
+        cull_only = False
+        n_sample = n_live #walkers the sample is culled from, those added below count from the next sample
+        if schedule is not None:
+            target = schedule.target(vol_max)
+            #add walkers by cloning and walking live walkers on the same rank, no sample is produced
+            new_walkers = pool.inactive_indices()[:max(target-pool.n_active,0)]
+            live = pool.active_indices()
+            for new_walker in new_walkers:
+                clone_source = live[np.random.randint(len(live))]
+                NS.clone_walker(clone_source+1,new_walker+1)
+                scheduler.cloned(clone_source)
+                scheduler.cloned(new_walker)
+            results = walk_walkers(SimParams,new_walkers,move_ratio,vol_max,dshear,dstretch,executor)
+            for new_walker, (new_vol,_) in zip(new_walkers,results):
+                pool.activate(new_walker,new_vol)
+                changed[new_walker] = True
+                scheduler.walked(new_walker,i,SimParams["walklength"])
+                if store is not None:
+                    store.publish(new_walker+1)
+            for r in range(size):
+                live_mask[r,np.flatnonzero(~live_mask[r])[:max(target-live_mask[r].sum(),0)]] = True
+            n_live = int(live_mask.sum())
+            #remove walkers by culling without replacement, except for the last live walker on a rank, which is
+            #replaced as usual so no rank runs out of walkers to walk
+            cull_only = n_live > target*size and live_mask[vol_max_index[0]].sum() > 1
 
         walker_to_clone = None
         if rank == 0:
-            walker_to_clone=divmod(np.random.randint(SimParams["nwalkers"]*size),SimParams["nwalkers"])
-            f.write(f"{i} {vol_max:.13f} {vol_max:.13f} \n")
-
-        walker_to_clone=comm.bcast(walker_to_clone,root=0)
-
-        config_to_clone=None
-        if rank==walker_to_clone[0]:
-            #print(i,walker_to_clone[0],vol_max_index[0])        
-            config_to_clone = NS.mk_ase_config(walker_to_clone[1]+1,SimParams["nbeads"],SimParams["nchains"],scaling=1.0)
-        config_to_clone = comm.bcast(config_to_clone, root = walker_to_clone[0])#,dest=vol_max_index[0])
-
-
-        if rank == vol_max_index[0]:
-            if i%traj_interval == 0:
-                NSio.write_to_extxyz(SimParams,vol_max_index[1]+1, filename=f"traj.extxyz")
-                #print(i, vol_max)
+            if cull_only:
+                walker_to_clone = (-1,-1)
+            else:
+                iclone = np.random.randint(n_live)
+                if n_live < live_mask.size:
+                    live_walkers = np.flatnonzero(live_mask)
+                    if live_mask[vol_max_index[0]].sum() == 1 and n_live > 1:
+                        #the culled walker is its rank's last, it is replaced by a copy of a walker on another rank
+                        live_walkers = live_walkers[live_walkers != vol_max_index[0]*SimParams["nboxes"]+vol_max_index[1]]
+                        iclone = np.random.randint(len(live_walkers))
+                    iclone = live_walkers[iclone]
+                walker_to_clone = divmod(iclone,SimParams["nboxes"])
+            f.append(i,vol_max,n_sample if schedule is not None else 0)
+            if evidence is not None:
+                evidence.add_sample(vol_max,n_sample if schedule is not None else None)
+
+        walker_to_clone=comms.broadcast_ints(comm,walker_to_clone)
+
+        if rank == vol_max_index[0] and i%traj_interval == 0:
+            if traj is not None:
+                NSio.write_to_hdf5_traj(SimParams,vol_max_index[1]+1,traj,i,vol_max)
+            else:
+                NSio.write_to_extxyz(SimParams,vol_max_index[1]+1, filename=NSio.shard_filename("traj.extxyz",rank), writer=writer, iteration=i)
+            #print(i, vol_max)
+        if archive is not None and rank == vol_max_index[0]:
+            NSio.write_to_hdf5_traj(SimParams,vol_max_index[1]+1,archive,i,vol_max)
+
+        if not cull_only:
+            #only the ranks holding the source and culled walkers take part in the clone
+            if rank==walker_to_clone[0]:
+                scheduler.cloned(walker_to_clone[1])
+            comms.clone_walker(comm,walker_to_clone[0],walker_to_clone[1]+1,vol_max_index[0],vol_max_index[1]+1,
+                               SimParams["nbeads"],SimParams["nchains"],store=store)
+
+        if rank == vol_max_index[0] and not cull_only:
             active_walker = vol_max_index[1]
-            NS.import_ase_to_ibox(config_to_clone,active_walker+1,SimParams)
+            scheduler.cloned(active_walker)
         else:
-            active_walker = np.random.randint(SimParams["nwalkers"])
-
-        new_vol,_ = NS.MC_run(SimParams,SimParams["walklength"], move_ratio,active_walker+1, volume_limit=vol_max,
-                                    min_ar=SimParams["min_aspect_ratio"], min_ang= SimParams["min_angle"],
-                                    dshear = dshear, dstretch = dstretch)
-
-        vols[active_walker] = new_vol
+            if rank == vol_max_index[0]:
+                pool.deactivate(vol_max_index[1])
+            active_walker = scheduler.select(pool.active_indices()) #walk the most correlated/stale walker
+        if cull_only:
+            live_mask[vol_max_index[0],vol_max_index[1]] = False
+            n_live -= 1
+
+        walkers = [active_walker]
+        if executor is not None:
+            #the extra workers walk the next most correlated/stale walkers at the same time
+            walkers += scheduler.select_many(executor.nworkers,pool.active_indices(),exclude=walkers)
+        results = walk_walkers(SimParams,walkers,move_ratio,vol_max,dshear,dstretch,executor)
+
+        for iwalker, (new_vol,_) in zip(walkers,results):
+            pool.update(iwalker,new_vol)
+            changed[iwalker] = True
+            scheduler.walked(iwalker,i,SimParams["walklength"])
+            if store is not None:
+                store.publish(iwalker+1)
 
 
         if i%mc_adjust_interval == 0:
             r, dshear,dstretch = NS.adjust_mc_steps(SimParams,comm,move_ratio,vol_max,walklength = mc_adjust_wl, 
-                      min_dstep=min_dstep, dv_max=dv_max,dr_max=dr_max,dshear = dshear, dstretch = dstretch)
+                      min_dstep=min_dstep, dv_max=dv_max,dr_max=dr_max,dshear = dshear, dstretch = dstretch,
+                      walkers = pool.active_indices())
             #Adjusting length of step sizes based on trial acceptance rates.
             if rank == 0:
                 print(i,vol_max,r)
 
         ####restart handler####
 
-        t1 = MPI.Wtime()
-        if rank == 0:            
-            if (SimParams["time"] - (t1-t0)) < 300.0: 
-                interrupted == True
-
-        interrupted = comm.bcast(interrupted,root=0)
-        if interrupted:
+        #a signal may reach any rank, so the requests are combined over all of them, the strongest winning
+        if rank == 0:
+            action = (checkpointer.action(),checkpointer.snapshot())
+        else:
+            action = (checkpointer.request(),checkpointer.snapshot())
+        action, snap = comms.max_ints(comm,action,n=2)
+        if action == checkpoint.STOP:
             if rank == 0:
-                f.close()
-                print("Out of allocated time, writing to file and exiting")
+                print("Out of allocated time or asked to stop, writing to file and exiting")
             break
-        if (i+1) % 50000 ==0:
-            if rank==0:
-                if os.path.exists("restart_backup.hdf5"):
-                    os.remove("restart_backup.hdf5")
-                if os.path.exists("restart.hdf5"):
-                    os.rename("restart.hdf5","restart_backup.hdf5")
-            NSio.write_to_restart(SimParams,comm,filename = "restart.hdf5",i=i, dshear = dshear, dstretch = dstretch)
+
+        if snap or (snapshot_interval and i % snapshot_interval == 0):
+            NSio.write_snapshot(SimParams,comm,f"snapshot.{i}.npy",pool.active,scheduler)
+            if rank == 0:
+                print(f"wrote snapshot.{i}.npy")
+
+        if "max_betaP" in SimParams and i%mc_adjust_interval == 0:
+            #stop once the live walkers can no longer contribute to Z at the largest betaP of interest
+            vol_min = min(comm.allgather(pool.quantile(0.0)))
+            converged = None
+            if rank == 0:
+                remaining = evidence.remaining_fraction(vol_min)
+                converged = remaining < SimParams["termination_tol"]
+                if converged:
+                    print(f"Remaining fraction of Z at betaP = {SimParams['max_betaP']} is {remaining:.3e}, stopping")
+            converged = comm.bcast(converged,root=0)
+            if converged:
+                break
+
+        if action == checkpoint.CHECKPOINT or (delta_interval and (i+1) % delta_interval == 0):
+            if pending is not None:
+                NSio.commit_restart(comm,pending,writer)
+            if rank == 0:
+                f.flush() #the samples up to the checkpoint are on file before it can be restarted from
+            if traj is not None:
+                traj.flush()
+            if archive is not None:
+                archive.flush()
+            if action == checkpoint.CHECKPOINT or n_deltas < 0 or n_deltas >= SimParams["max_deltas"]:
+                #a full checkpoint, which also compacts the chain of deltas
+                if rank==0:
+                    checkpointer.checkpoint_started()
+                    NSio.rotate_restart("restart.hdf5","restart_backup.hdf5")
+                comm.Barrier()
+                pending = NSio.write_to_restart(SimParams,comm,filename = "restart.hdf5",i=i, dshear = dshear, dstretch = dstretch, active = pool.active,
+                                    scheduler = scheduler, writer = writer)
+                if rank==0:
+                    if writer is not None:
+                        writer.submit(checkpointer.checkpoint_done) #once the shard has actually been written
+                    else:
+                        checkpointer.checkpoint_done()
+                n_deltas = 0
+            else:
+                n_deltas += 1
+                pending = NSio.write_restart_delta(SimParams,comm,"restart.hdf5",n_deltas,changed,i=i,dshear = dshear, dstretch = dstretch,
+                                         active = pool.active, scheduler = scheduler, writer = writer)
+            commit_at = i + commit_lag
+            changed[:] = False
             sys.stdout.flush()
             if rank ==0:
                 print("wrote to restart")
@@ -283,21 +476,33 @@ def main(SimParams):
 #######################################################################################
 # END NESTED SAMPLING LOOP                                                            #
 #######################################################################################
+    #flush point, every background write is finished before the final restart is written
+    if pending is not None:
+        NSio.commit_restart(comm,pending,writer)
     if rank == 0:
         f.close()
+    if traj is not None:
+        traj.close()
+    if archive is not None:
+        archive.close()
+    if writer is not None:
+        writer.close()
 
     ns_t1 = timer()
     if rank == 0:
         print("NS RUN TIME TAKEN =", ns_t1-ns_t0)            
         print("writing restart")
-
-        if os.path.exists("restart_backup.hdf5"):
-            os.remove("restart_backup.hdf5")
-        if os.path.exists("restart.hdf5"):
-            os.rename("restart.hdf5","restart_backup.hdf5")
-    NSio.write_to_restart(SimParams,comm,filename = "restart.hdf5",i=i,dshear=dshear, dstretch = dstretch)
+        NSio.rotate_restart("restart.hdf5","restart_backup.hdf5")
+    comm.Barrier()
+    NSio.write_to_restart(SimParams,comm,filename = "restart.hdf5",i=i,dshear=dshear, dstretch = dstretch, active = pool.active,
+                            scheduler = scheduler)
 
     sys.stdout.flush()
+    checkpointer.restore_handlers()
+    if store is not None:
+        store.free()
+    if executor is not None:
+        executor.close()
     NS.alk.alkane_destroy()
     NS.alk.box_destroy()
 
@@ -323,7 +528,7 @@ def main(SimParams):
                 "entropy":False,
                 "quiet":False,
                 "kolmogorov_smirnov_test":False,
-                "files":"volumes.txt"}
+                "files":volumes_file}
         with open('ns_analyse.out', 'w') as f:
             with redirect_stdout(f):
                 ns_analyse_main.analyse(nsa_args)
@@ -340,6 +545,6 @@ if __name__ == "__main__":
     if "profile" in SimParams:
         if SimParams["profile"]:
             prof.disable()
-            prof.dump_stats(f"mpihans{rank}.profile")
+            prof.dump_stats(f"mpihans{get_comm().Get_rank()}.profile")
     exit()
 
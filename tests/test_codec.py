@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from NesSa import codec
+
+
+def random_walker(rng, nchains=12, nbeads=8, bondlength=0.4):
+    """Random cell and chains, grown as random walks which may leave the cell."""
+    cell = np.diag(rng.uniform(4.0, 8.0, 3)) + np.tril(rng.uniform(-1.0, 1.0, (3,3)), -1)
+    steps = rng.normal(size=(nchains, nbeads-1, 3))
+    steps *= bondlength/np.linalg.norm(steps, axis=-1, keepdims=True)
+    starts = rng.random((nchains, 1, 3)) @ cell
+    coords = np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1)
+    return cell, coords
+
+
+@pytest.mark.parametrize("bits", [16, 24])
+def test_roundtrip_within_bound_without_overlaps(bits):
+    rng = np.random.default_rng(bits)
+    for _ in range(20):
+        cell, coords = random_walker(rng)
+        error, bound, overlaps = codec.check_roundtrip(cell, coords, bits)
+        assert error <= bound
+        assert overlaps == 0
+
+
+@pytest.mark.parametrize("bits", [0, 31])
+def test_check_bits_rejects_out_of_range(bits):
+    with pytest.raises(ValueError):
+        codec.check_bits(bits)
+    with pytest.raises(ValueError):
+        codec.encode(np.eye(3), np.zeros((1,1,3)), bits)
+
+
+@pytest.mark.parametrize("bits", [1, 30])
+def test_check_bits_accepts_range(bits):
+    codec.check_bits(bits)
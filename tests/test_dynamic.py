@@ -0,0 +1,29 @@
+import numpy as np
+from NesSa import ns_analyse
+from NesSa.convergence import EvidenceTracker
+
+
+def synthetic_schedule(n_samples=300, seed=1):
+    """Numbers of live walkers K_n each sample is culled from, growing and shrinking as with a walker schedule."""
+    rng = np.random.default_rng(seed)
+    Ks = np.concatenate([np.full(n_samples//3, 10), np.arange(10, 10+n_samples//3), np.full(n_samples-2*(n_samples//3), 25)])
+    Es = np.sort(rng.random(n_samples))[::-1]*10
+    return Ks, Es
+
+
+def test_variable_prior_volumes():
+    Ks, _ = synthetic_schedule()
+    X = np.cumprod(Ks/(Ks+1.0))
+    X_next = np.append(X[1:], X[-1]*Ks[-1]/(Ks[-1]+1.0)) #the last sample's shell uses its own K
+    log_a = ns_analyse.calc_log_a_variable(Ks)
+    assert np.allclose(np.exp(log_a), X - X_next)
+
+
+def test_evidence_tracker_matches_replay():
+    Ks, Es = synthetic_schedule()
+    tracker = EvidenceTracker(int(Ks[0]), 0.7)
+    for vol, K in zip(Es, Ks):
+        tracker.add_sample(vol, int(K))
+    log_a = ns_analyse.calc_log_a_variable(Ks)
+    assert np.isclose(tracker.total_log_Z(), np.logaddexp.reduce(log_a - 0.7*Es))
+    assert np.isclose(tracker.log_X, np.sum(np.log(Ks/(Ks+1.0))))